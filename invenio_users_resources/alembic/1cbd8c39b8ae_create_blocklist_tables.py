@@ -0,0 +1,44 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Create domain blocklist tables."""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "1cbd8c39b8ae"
+down_revision = "fe16be13c058"
+branch_labels = ()
+depends_on = None
+
+
+def upgrade():
+    """Upgrade database."""
+    op.create_table(
+        "users_resources_blocklist_sources",
+        sa.Column("name", sa.String(length=255), nullable=False),
+        sa.Column("url", sa.Text(), nullable=False),
+        sa.Column("hash", sa.String(length=64), nullable=True),
+        sa.Column("etag", sa.String(length=255), nullable=True),
+        sa.Column("last_modified", sa.String(length=64), nullable=True),
+        sa.Column("updated", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint(
+            "name", name=op.f("pk_users_resources_blocklist_sources")
+        ),
+    )
+    op.create_table(
+        "users_resources_blocklist_entries",
+        sa.Column("source", sa.String(length=255), nullable=False),
+        sa.Column("domain", sa.String(length=255), nullable=False),
+        sa.Column("import_id", sa.String(length=32), nullable=False),
+        sa.PrimaryKeyConstraint(
+            "source", "domain", name=op.f("pk_users_resources_blocklist_entries")
+        ),
+    )
+
+
+def downgrade():
+    """Downgrade database."""
+    op.drop_table("users_resources_blocklist_entries")
+    op.drop_table("users_resources_blocklist_sources")
@@ -0,0 +1,18 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Create users resources branch."""
+
+# revision identifiers, used by Alembic.
+revision = "903a3741483f"
+down_revision = None
+branch_labels = ("invenio_users_resources",)
+depends_on = "dbdbc1b19cf2"
+
+
+def upgrade():
+    """Upgrade database."""
+
+
+def downgrade():
+    """Downgrade database."""
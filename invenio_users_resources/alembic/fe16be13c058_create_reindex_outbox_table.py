@@ -0,0 +1,36 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Create reindex outbox table."""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "fe16be13c058"
+down_revision = "903a3741483f"
+branch_labels = ()
+depends_on = None
+
+
+def upgrade():
+    """Upgrade database."""
+    op.create_table(
+        "users_resources_reindex_outbox",
+        sa.Column(
+            "id",
+            sa.BigInteger().with_variant(sa.Integer(), "sqlite"),
+            autoincrement=True,
+            nullable=False,
+        ),
+        sa.Column("record_type", sa.String(length=16), nullable=False),
+        sa.Column("record_id", sa.String(length=255), nullable=False),
+        sa.Column("op", sa.String(length=16), nullable=False),
+        sa.Column("created", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_users_resources_reindex_outbox")),
+    )
+
+
+def downgrade():
+    """Downgrade database."""
+    op.drop_table("users_resources_reindex_outbox")
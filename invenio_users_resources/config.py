@@ -5,6 +5,8 @@
 
 """Invenio module providing management APIs for users and roles/groups."""
 
+from datetime import timedelta
+
 from invenio_i18n import lazy_gettext as _
 from marshmallow import Schema, fields, validate
 
@@ -46,6 +48,46 @@ USERS_RESOURCES_AVATAR_COLORS = [
 USERS_RESOURCES_SERVICE_SCHEMA = UserSchema
 """Schema used by the users service."""
 
+USERS_RESOURCES_SEARCH_PROJECTION = True
+"""Project the user search hits straight into the results.
+
+When enabled, the hits of a search by an identity that may read all details
+of any user (e.g. a user manager) are projected from the indexed documents,
+with the permissions and links worked out once per search, instead of being
+loaded and dumped one by one. The hits are only projected if the identity is
+granted the field permissions by generators which don't depend on the user,
+and the other generators can't deny them for some users.
+"""
+
+USERS_RESOURCES_SEARCH_SUPERADMIN_FLAG = False
+"""Hide the superadmins from the user managers via their indexed flag.
+
+When enabled, the superadmin users are excluded from the searches of the
+user managers with a single clause on the ``is_superadmin`` flag of the
+indexed users, instead of a clause listing their IDs. Enable it only once all
+the users have been reindexed with the flag.
+
+The flag is mapped by the ``users-user-v3.1.0`` index, in which the users
+are indexed regardless of this setting. Before deploying the version which
+introduced it, create the index with ``invenio index init`` and reindex all
+the users into it (e.g. with ``current_users_service.rebuild_index()``).
+"""
+
+USERS_RESOURCES_SUPERADMINS_CACHE_TIMEOUT = 60 * 60
+"""Time, in seconds, for which the IDs of the superadmin users are cached.
+
+The IDs are invalidated by any commit of the database session which changes
+the superadmin access, or the members of the roles. ``0`` disables the
+caching.
+"""
+
+USERS_RESOURCES_SUPERADMIN_ROLES_CACHE_TTL = 5 * 60
+"""Time, in seconds, for which each process keeps the superadmin role IDs.
+
+The IDs are dropped by all processes when a commit of the DB session changes
+the superadmin access of roles, or deletes roles. ``0`` disables the caching.
+"""
+
 USERS_RESOURCES_SEARCH = {
     "sort": ["bestmatch", "username", "email", "domain", "newest", "oldest", "updated"],
     "facets": [
@@ -306,5 +348,153 @@ class OrgPropsSchema(Schema):
 USERS_RESOURCES_DOMAINS_ORG_SCHEMA = OrgPropsSchema
 """Domains organisation schema config."""
 
+USERS_RESOURCES_DOMAINS_BLOCKLIST_BATCH_SIZE = 1000
+"""Number of domains of a blocklist that are imported per transaction."""
+
+USERS_RESOURCES_DOMAINS_TRIE_REFRESH_INTERVAL = 60
+"""Interval, in seconds, for refreshing the lookup of flagged and blocked domains.
+
+Each process keeps the flagged and blocked domains in memory, to apply their
+status to their subdomains. The domains updated since the last refresh are
+loaded at most once per interval, or right away when the cached domains are
+invalidated after a change of domains.
+"""
+
+USERS_RESOURCES_DOMAINS_TRIE_REBUILD_INTERVAL = 60 * 60
+"""Interval, in seconds, for rebuilding the lookup of flagged and blocked domains."""
+
+USERS_RESOURCES_DOMAINS_TRIE_REFRESH_OVERLAP = timedelta(minutes=5)
+"""Overlap between consecutive refreshes of the lookup of flagged and blocked domains.
+
+The domains updated by transactions which were not committed yet when the
+last refresh started are picked up by the next refresh, as long as these
+transactions take less than this time.
+"""
+
+USERS_RESOURCES_DOMAINS_CACHE_SIZE = 10000
+"""Maximum number of domains whose information is cached per process."""
+
+USERS_RESOURCES_DOMAINS_CACHE_TTL = 5 * 60
+"""Time, in seconds, for which the information about a domain is cached.
+
+The cached information is dropped by all processes whenever a domain is
+changed, which is signalled through the shared cache.
+"""
+
+USERS_RESOURCES_DOMAINS_UPDATE_COUNTERS_ON_CHANGE = False
+"""Recompute the user counters of the domains of changed users.
+
+When enabled, the counters of the domains of the users that were created,
+deleted, or whose activation, confirmation, verification, blocking or domain
+changed are recomputed asynchronously after the commit. Otherwise, the
+counters of all domains can be recomputed periodically with the
+``update_domain_counters`` task.
+"""
+
 USERS_RESOURCES_GROUPS_ENABLED = True
 """Config to enable features related to existence of groups."""
+
+USERS_RESOURCES_REINDEX_CHUNK_SIZE = 1000
+"""Maximum number of IDs sent in a single (un)indexing task.
+
+Larger sets of IDs are split into a group of tasks, which are spread across
+the workers and retried independently of each other.
+"""
+
+USERS_RESOURCES_LOW_PRIORITY_USER_ATTRIBUTES = {"login_info"}
+"""User model attributes whose changes alone do not trigger a reindex.
+
+By default, this covers the login information which is attached to a user on
+their first login (the later logins only update the login information itself,
+which does not reindex the user). The values in the index are refreshed with
+the next reindex of the user.
+"""
+
+USERS_RESOURCES_INDEX_EXISTS_CACHE_TTL = 30
+"""Time, in seconds, for which the existence of the indices is cached.
+
+The (un)indexing tasks only run if the index exists, which is checked once
+per process and index within this time. Set to ``0`` to always check.
+"""
+
+USERS_RESOURCES_INDEXED_VERSIONS_CACHE_TIMEOUT = 60 * 60
+"""Time, in seconds, for which the indexed versions are remembered.
+
+The reindexing of a user or group is skipped when the version committed by
+the change that triggered it has already been indexed, e.g. when tasks are
+retried or duplicated.
+"""
+
+USERS_RESOURCES_REINDEX_QUEUE_ENABLED = False
+"""Coalesce the reindexing of users, groups and domains across transactions.
+
+When enabled, the IDs of the updated users, groups and domains are added to
+a set instead of being reindexed right away, so that an entity which is
+updated several times is reindexed only once. The sets are drained by the
+``drain_reindex_queues`` task, which needs to be scheduled periodically, e.g.:
+
+.. code-block:: python
+
+    CELERY_BEAT_SCHEDULE = {
+        "users-resources-reindex": {
+            "task": "invenio_users_resources.services.queue.drain_reindex_queues",
+            "schedule": timedelta(seconds=30),
+        },
+    }
+"""
+
+USERS_RESOURCES_REINDEX_QUEUE_URL = None
+"""Redis URL for the reindex queues, defaults to ``CACHE_REDIS_URL``.
+
+Use ``memory://`` for process-local queues, e.g. in tests.
+"""
+
+USERS_RESOURCES_REINDEX_QUEUE_MAX_BATCHES = 10
+"""Maximum number of batches taken from each reindex queue per drain."""
+
+USERS_RESOURCES_REINDEX_OUTBOX_ENABLED = False
+"""Record the pending (un)indexing in a database table.
+
+When enabled, the updated and deleted users, groups and domains are written
+to an outbox table in the same transaction as the changes, and indexed by
+the ``process_reindex_outbox`` task. The task is triggered after each commit,
+but should also be scheduled periodically to replay the changes that could
+not be indexed, e.g.:
+
+.. code-block:: python
+
+    CELERY_BEAT_SCHEDULE = {
+        "users-resources-reindex-outbox": {
+            "task": "invenio_users_resources.services.outbox.process_reindex_outbox",
+            "schedule": timedelta(minutes=5),
+        },
+    }
+"""
+
+USERS_RESOURCES_REINDEX_OUTBOX_MAX_BATCHES = 10
+"""Maximum number of batches processed from the reindex outbox per run."""
+
+USERS_RESOURCES_REBUILD_INDEX_PARTITION_SIZE = 50000
+"""Number of entities reindexed per task by a partitioned index rebuild."""
+
+USERS_RESOURCES_REBUILD_INDEX_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+"""Time, in seconds, for which the progress of an index rebuild is kept."""
+
+USERS_RESOURCES_REBUILD_INDEX_REPLAY_ENABLED = False
+"""Replay the entities reindexed during an alias-swap rebuild of an index.
+
+Not all the changes reindexed during a rebuild update the entities (e.g. the
+superadmin access of a user, or the status of their domain), so they can't all
+be replayed by their ``updated`` timestamp. When enabled, the reindexing tasks check whether a rebuild is
+running, and if so record the reindexed IDs in a queue (using
+``USERS_RESOURCES_REINDEX_QUEUE_URL``, shared by the workers), which is
+replayed into the new index before it replaces the old one.
+"""
+
+USERS_RESOURCES_REINDEX_WATERMARK_OVERLAP = timedelta(minutes=5)
+"""Overlap between consecutive runs of the incremental reindex.
+
+The entities updated by transactions which were not committed yet when the
+last run started are picked up by the next run, as long as these
+transactions take less than this time.
+"""
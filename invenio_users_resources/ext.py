@@ -6,14 +6,27 @@
 
 """Invenio module providing management APIs for users and roles/groups."""
 
+from functools import cached_property
+
+from flask import current_app
 from invenio_accounts.proxies import current_db_change_history
 from invenio_accounts.signals import datastore_post_commit, datastore_pre_commit
 from invenio_base.utils import entry_points
 from invenio_db import db
 from sqlalchemy import event
+from sqlalchemy.orm import Session
 
 from . import config
-from .records.hooks import post_commit, pre_commit
+from .records.domains import DomainCache, DomainTrie
+from .records.hooks import (
+    post_commit,
+    pre_commit,
+    superadmins_after_commit,
+    superadmins_after_flush,
+    superadmins_after_rollback,
+    superadmins_before_flush,
+    superadmins_do_orm_execute,
+)
 from .resources import (
     DomainsResource,
     DomainsResourceConfig,
@@ -30,6 +43,7 @@ from .services import (
     UsersService,
     UsersServiceConfig,
 )
+from .services.queue import ReindexQueue, queue_backend_from_url
 
 
 class InvenioUsersResources(object):
@@ -87,6 +101,15 @@ class InvenioUsersResources(object):
         datastore_pre_commit.connect(pre_commit)
         datastore_post_commit.connect(post_commit)
 
+        # the superadmins are also changed outside of the datastore, and with
+        # sessions other than ``db.session`` (whose listeners are only bound to
+        # the class of its session factory)
+        event.listen(Session, "before_flush", superadmins_before_flush)
+        event.listen(Session, "after_flush", superadmins_after_flush)
+        event.listen(Session, "do_orm_execute", superadmins_do_orm_execute)
+        event.listen(Session, "after_commit", superadmins_after_commit)
+        event.listen(Session, "after_rollback", superadmins_after_rollback)
+
         @event.listens_for(db.session, "after_rollback")
         def _after_rollback(session):
             """When a session is rolled back, we don't reindex anything."""
@@ -96,6 +119,44 @@ class InvenioUsersResources(object):
             # the sets might not reflect all the users that were changed.
             current_db_change_history.clear_dirty_sets(session)
 
+    @cached_property
+    def queue_backend(self):
+        """Backend of the reindex queues."""
+        url = current_app.config["USERS_RESOURCES_REINDEX_QUEUE_URL"]
+        return queue_backend_from_url(url or current_app.config["CACHE_REDIS_URL"])
+
+    @cached_property
+    def reindex_queues(self):
+        """Coalescing reindex queues per record type, if enabled."""
+        if not current_app.config["USERS_RESOURCES_REINDEX_QUEUE_ENABLED"]:
+            return {}
+
+        return {
+            name: ReindexQueue(name, self.queue_backend)
+            for name in ("users", "groups", "domains")
+        }
+
+    @cached_property
+    def rebuild_queues(self):
+        """Queues of the IDs reindexed while an index is rebuilt, if enabled."""
+        if not current_app.config["USERS_RESOURCES_REBUILD_INDEX_REPLAY_ENABLED"]:
+            return {}
+
+        return {
+            name: ReindexQueue(f"rebuild:{name}", self.queue_backend)
+            for name in ("users", "groups", "domains")
+        }
+
+    @cached_property
+    def domain_trie(self):
+        """Lookup of the flagged and blocked domains, including subdomains."""
+        return DomainTrie()
+
+    @cached_property
+    def domain_cache(self):
+        """Cache of the dumped information about domains."""
+        return DomainCache()
+
     def init_actions_registry(self):
         """Initialises moderation actions registry."""
         self.actions_registry = {}
@@ -12,8 +12,7 @@ from collections import namedtuple
 from datetime import datetime
 
 from flask import current_app
-from invenio_access import ActionRoles, superuser_access
-from invenio_accounts.models import Domain, User
+from invenio_accounts.models import Domain, DomainOrg, User
 from invenio_accounts.proxies import current_datastore
 from invenio_db import db
 from invenio_i18n import gettext as _
@@ -25,9 +24,11 @@ from invenio_records_resources.records.systemfields import IndexField
 from marshmallow import ValidationError
 from sqlalchemy import or_, select
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import joinedload, selectinload
 
 from .dumpers import EmailFieldDumperExt
 from .models import DomainAggregateModel, GroupAggregateModel, UserAggregateModel
+from .superadmins import superadmin_role_ids
 from .systemfields import (
     AccountStatusField,
     AccountVisibilityField,
@@ -36,6 +37,7 @@ from .systemfields import (
     DomainOrgField,
     DomainStatusNameField,
     IsNotNoneField,
+    IsSuperadminField,
     UserIdentitiesField,
     UserRolesField,
 )
@@ -176,8 +178,12 @@ class UserAggregate(BaseAggregate):
     )
     """Search dumper with configured extensions."""
 
-    index = IndexField("users-user-v3.0.0", search_alias="users")
-    """The search engine index to use."""
+    index = IndexField("users-user-v3.1.0", search_alias="users")
+    """The search engine index to use.
+
+    The index must be created (``invenio index init``) and all the users
+    reindexed into it before deploying a new version of its mapping.
+    """
 
     id = ModelField("id", dump_type=int)
     """The user identifier."""
@@ -251,6 +257,9 @@ class UserAggregate(BaseAggregate):
     roles = UserRolesField("roles", index=True)
     """User role names."""
 
+    is_superadmin = IsSuperadminField(index=True)
+    """Determine if the user has superadmin access."""
+
     @property
     def avatar_chars(self):
         """Get avatar characters for user."""
@@ -453,6 +462,35 @@ class UserAggregate(BaseAggregate):
         with db.session.no_autoflush:
             return cls.from_model(user)
 
+    @classmethod
+    def get_records(cls, ids):
+        """Get the users for the given IDs in a constant number of queries.
+
+        Users are fetched together with their roles, and their identities and
+        domains are prefetched in one query each, which are used to pre-seed
+        the caches of the calculated fields. The returned list follows the order
+        of ``ids``, with ``None`` for users that could not be found.
+        """
+        user_ids = {int(id_) for id_ in ids if str(id_).isdigit()}
+        if not user_ids:
+            return [None for _ in ids]
+
+        with db.session.no_autoflush:
+            users = (
+                db.session.query(User)
+                .filter(User.id.in_(user_ids))
+                .options(selectinload(User.roles))
+                .all()
+            )
+
+            records = {user.id: cls.from_model(user) for user in users}
+            for field in (cls.domaininfo, cls.identities):
+                values = field.prefetch(list(records.values()))
+                for record in records.values():
+                    field._set_cache(record, values[record.id])
+
+        return [records.get(int(id_)) if str(id_).isdigit() else None for id_ in ids]
+
 
 class GroupAggregate(BaseAggregate):
     """An aggregate of information about a user group/role."""
@@ -514,10 +552,7 @@ class GroupAggregate(BaseAggregate):
     @classmethod
     def superadmin_group_ids(cls):
         """Return group IDs that grant superuser access."""
-        return {
-            str(action_role.role_id)
-            for action_role in ActionRoles.query_by_action(superuser_access).all()
-        }
+        return superadmin_role_ids()
 
     @classmethod
     def available_groups(cls, exclude_group_ids=None):
@@ -538,6 +573,25 @@ class GroupAggregate(BaseAggregate):
                 return None
             return cls.from_model(role)
 
+    @classmethod
+    def get_records(cls, ids):
+        """Get the user groups for the given IDs in a single query.
+
+        The returned list follows the order of ``ids``, with ``None`` for
+        groups that could not be found.
+        """
+        role_ids = {str(id_) for id_ in ids}
+        if not role_ids:
+            return []
+
+        role_model = current_datastore.role_model
+        with db.session.no_autoflush:
+            roles = (
+                db.session.query(role_model).filter(role_model.id.in_(role_ids)).all()
+            )
+            records = {str(role.id): cls.from_model(role) for role in roles}
+        return [records.get(str(id_)) for id_ in ids]
+
     @classmethod
     def get_record_by_name(cls, name):
         """Get the user group via the specified ID."""
@@ -689,6 +743,42 @@ class DomainAggregate(BaseAggregate):
             raise NoResultFound()
         return cls.from_model(domain)
 
+    @classmethod
+    def get_records(cls, ids):
+        """Get the domains for the given IDs or names in a single query.
+
+        Like ``get_record()``, each value can either be a domain ID or a domain
+        name. The organisations (and their parents) and categories are loaded
+        together with the domains. The returned list follows the order of
+        ``ids``, with ``None`` for domains that could not be found.
+        """
+        domain_ids = {int(id_) for id_ in ids if str(id_).isdigit()}
+        domain_names = {id_ for id_ in ids if not str(id_).isdigit()}
+        if not domain_ids and not domain_names:
+            return []
+
+        with db.session.no_autoflush:
+            domains = (
+                db.session.query(Domain)
+                .filter(or_(Domain.id.in_(domain_ids), Domain.domain.in_(domain_names)))
+                .options(
+                    selectinload(Domain.org).selectinload(DomainOrg.parent),
+                    joinedload(Domain.category_name),
+                )
+                .all()
+            )
+            records_by_id = {domain.id: cls.from_model(domain) for domain in domains}
+
+        records_by_name = {r.domain: r for r in records_by_id.values()}
+        return [
+            (
+                records_by_id.get(int(id_))
+                if str(id_).isdigit()
+                else records_by_name.get(id_)
+            )
+            for id_ in ids
+        ]
+
     @classmethod
     def create(cls, data, id_=None, **kwargs):
         """Create a domain."""
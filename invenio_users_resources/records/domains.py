@@ -0,0 +1,238 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""In-memory lookups of domains, for dumping the domains of many users."""
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+from time import monotonic
+from uuid import uuid4
+
+from flask import current_app
+from invenio_accounts.models import Domain
+from invenio_accounts.utils import DomainStatus
+from invenio_cache import current_cache
+from invenio_db import db
+from sqlalchemy import or_, select
+
+_VALUE = ""
+"""Key of the node values in the trie (which is never a domain label)."""
+
+
+def _labels(domain):
+    """Split a domain name into its labels, starting with the top-level one."""
+    return reversed(domain.lower().rstrip(".").split("."))
+
+
+class DomainTrie:
+    """Trie of the flagged and blocked domains, keyed by their reversed labels.
+
+    A domain is matched by its closest flagged or blocked parent domain (or
+    itself) in as many steps as it has labels, e.g. ``mail.spam.com`` by
+    ``spam.com``. The trie is built from the ``Domain`` table and refreshed
+    with the domains updated since, at most every
+    ``USERS_RESOURCES_DOMAINS_TRIE_REFRESH_INTERVAL`` seconds. It is rebuilt
+    from scratch every ``USERS_RESOURCES_DOMAINS_TRIE_REBUILD_INTERVAL``
+    seconds, which also drops the domains that were deleted.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self._root = {}
+        self._lock = Lock()
+        self._refreshed = None
+        self._next_refresh = 0
+        self._next_rebuild = 0
+
+    @staticmethod
+    def dump(domain):
+        """Dump the information about a domain (or a row), as stored in the trie."""
+        return {
+            "tld": domain.tld,
+            "status": domain.status.value,
+            "category": domain.category,
+            "flagged": domain.flagged,
+        }
+
+    @staticmethod
+    def is_listed(domain):
+        """Check if a domain belongs in the trie."""
+        return domain.flagged or domain.status == DomainStatus.blocked
+
+    def add(self, name, value, root=None):
+        """Add a domain to the trie."""
+        node = self._root if root is None else root
+        for label in _labels(name):
+            node = node.setdefault(label, {})
+        node[_VALUE] = value
+
+    def remove(self, name, root=None):
+        """Remove a domain from the trie, if it is in it."""
+        node = self._root if root is None else root
+        for label in _labels(name):
+            node = node.get(label)
+            if node is None:
+                return
+        node.pop(_VALUE, None)
+
+    def match(self, name, include_self=True):
+        """Find the closest flagged or blocked (parent) domain of a domain.
+
+        :param include_self: Match the domain itself too, not only its
+            parent domains.
+        :returns: A tuple with the name and information of the matched
+            domain, or ``None``.
+        """
+        self.refresh()
+        labels = list(_labels(name))
+        if not include_self:
+            labels = labels[:-1]
+
+        node, found = self._root, None
+        for depth, label in enumerate(labels, start=1):
+            node = node.get(label)
+            if node is None:
+                break
+            if _VALUE in node:
+                found = (".".join(reversed(labels[:depth])), node[_VALUE])
+        return found
+
+    def refresh(self, force=False):
+        """Update the trie with the domains changed since the last refresh.
+
+        :param force: Refresh the trie right away, e.g. after domains were
+            changed, rather than once the refresh interval has passed.
+        """
+        now = monotonic()
+        if not force and now < self._next_refresh:
+            return
+
+        config = current_app.config
+        with self._lock:
+            rebuild = now >= self._next_rebuild
+            # the timestamps of running transactions predate their commit
+            overlap = config["USERS_RESOURCES_DOMAINS_TRIE_REFRESH_OVERLAP"]
+            started = datetime.now(timezone.utc) - overlap
+
+            query = select(
+                Domain.domain,
+                Domain.tld,
+                Domain.status,
+                Domain.category,
+                Domain.flagged,
+            )
+            if rebuild:
+                query = query.where(
+                    or_(Domain.flagged.is_(True), Domain.status == DomainStatus.blocked)
+                )
+            else:
+                query = query.where(Domain.updated >= self._refreshed)
+
+            # a rebuilt trie replaces the current one once complete
+            root = {} if rebuild else self._root
+            for domain in db.session.execute(query):
+                if self.is_listed(domain):
+                    self.add(domain.domain, self.dump(domain), root=root)
+                else:
+                    self.remove(domain.domain, root=root)
+            self._root = root
+
+            self._refreshed = started
+            self._next_refresh = (
+                now + config["USERS_RESOURCES_DOMAINS_TRIE_REFRESH_INTERVAL"]
+            )
+            if rebuild:
+                self._next_rebuild = (
+                    now + config["USERS_RESOURCES_DOMAINS_TRIE_REBUILD_INTERVAL"]
+                )
+
+
+class DomainCache:
+    """Bounded cache of the dumped information about domains, by their name.
+
+    Many users share the same few domains, which are thus only fetched once
+    for all of them. The entries expire after
+    ``USERS_RESOURCES_DOMAINS_CACHE_TTL`` seconds, and the least recently
+    used ones are evicted beyond ``USERS_RESOURCES_DOMAINS_CACHE_SIZE``
+    entries. All processes drop their entries whenever a domain changes, as
+    signalled through a generation in the shared cache, which is checked by
+    ``sync()`` (once per batch of dumped users), upon which the lookup of the
+    flagged and blocked domains is refreshed too (see ``DomainField``).
+    """
+
+    generation_key = "users-resources:domains:generation"
+    """Key of the generation of the domains in the shared cache."""
+
+    def __init__(self):
+        """Constructor."""
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._generation = None
+
+    def get_many(self, names):
+        """Get the cached entries of the given domain names."""
+        now = monotonic()
+        found = {}
+        with self._lock:
+            for name in names:
+                entry = self._entries.get(name)
+                if entry is None:
+                    continue
+                value, expires = entry
+                if expires <= now:
+                    del self._entries[name]
+                    continue
+                self._entries.move_to_end(name)
+                found[name] = value
+        return found
+
+    def set_many(self, values):
+        """Cache the entries of the given domain names."""
+        config = current_app.config
+        expires = monotonic() + config["USERS_RESOURCES_DOMAINS_CACHE_TTL"]
+        size = config["USERS_RESOURCES_DOMAINS_CACHE_SIZE"]
+        with self._lock:
+            for name, value in values.items():
+                self._entries[name] = (value, expires)
+                self._entries.move_to_end(name)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def sync(self):
+        """Drop the entries if the domains changed in any process.
+
+        If the generation can't be checked, the entries are dropped as well,
+        but the domains aren't considered as changed.
+
+        :returns: Whether the domains changed.
+        """
+        try:
+            generation = current_cache.get(self.generation_key)
+        except Exception:
+            current_app.logger.warning(
+                "Could not check the generation of the domains.", exc_info=True
+            )
+            self.clear()
+            self._generation = None
+            return False
+        if generation == self._generation:
+            return False
+        self.clear()
+        self._generation = generation
+        return True
+
+    def clear(self):
+        """Drop the entries of this process."""
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self):
+        """Drop the entries of all processes, after a change of domains."""
+        self.clear()
+        try:
+            current_cache.set(self.generation_key, uuid4().hex, timeout=0)
+        except Exception:
+            current_app.logger.warning(
+                "Could not invalidate the cached domains.", exc_info=True
+            )
@@ -5,25 +5,139 @@
 
 """Invenio users DB hooks."""
 
-from invenio_accounts.models import Domain, Role, User
+from itertools import chain
+
+from flask import current_app, has_app_context
+from invenio_access import ActionRoles, ActionUsers
+from invenio_accounts.models import Domain, Role, User, userrole
 from invenio_accounts.proxies import current_db_change_history
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy import select
 
-from ..services.domains.tasks import delete_domains, reindex_domains
-from ..services.groups.tasks import reindex_groups, unindex_groups
-from ..services.users.tasks import reindex_users, unindex_users
+from ..proxies import current_user_resources
+from ..services.domains.tasks import delete_domains, update_domain_counters
+from ..services.groups.tasks import unindex_groups
+from ..services.outbox import process_reindex_outbox, write_outbox
+from ..services.permissions import reset_permission_decisions
+from ..services.queue import dispatch_reindex
+from ..services.users.tasks import reindex_group_members, unindex_users
+from ..utils import dispatch_chunked
+from .superadmins import (
+    invalidate_superadmin_role_ids,
+    invalidate_superadmin_user_ids,
+    query_superadmin_user_ids,
+)
 
+VERSIONS_KEY = "users_resources_versions"
+"""Key in the session info, for the versions committed for users and groups."""
 
-def _role_user_ids(role):
-    """Safely collect user IDs linked to a role."""
-    if role is None:
-        return []
+COUNTER_DOMAINS_KEY = "users_resources_counter_domains"
+"""Key in the session info, for the domains whose user counters changed."""
+
+DOMAINS_CHANGED_KEY = "users_resources_domains_changed"
+"""Key in the session info, flagging that domains were changed."""
+
+SUPERADMINS_CHANGED_KEY = "users_resources_superadmins_changed"
+"""Key in the session info, flagging that the superadmins may have changed."""
+
+SUPERADMIN_USERS_KEY = "users_resources_superadmin_users"
+"""Key in the session info, for the users whose superadmin access changed."""
+
+PREVIOUS_SUPERADMINS_KEY = "users_resources_previous_superadmins"
+"""Key in the session info, for the superadmin users before a flush."""
+
+SUPERADMIN_TABLES = {
+    ActionUsers.__tablename__,
+    ActionRoles.__tablename__,
+    Role.__tablename__,
+    userrole.name,
+}
+"""Tables whose changes may affect the users with superadmin access."""
 
-    try:
-        users = getattr(role, "users", []) or []
-        return [user.id for user in users if getattr(user, "id", None) is not None]
-    except (AttributeError, TypeError):
+SUPERADMIN_ROLES_CHANGED_KEY = "users_resources_superadmin_roles_changed"
+"""Key in the session info, flagging that the superadmin roles may have changed."""
+
+SUPERADMIN_ROLES_TABLES = {ActionRoles.__tablename__, Role.__tablename__}
+"""Tables whose changes may affect the roles with superadmin access."""
+
+COUNTER_ATTRIBUTES = {"active", "confirmed_at", "verified_at", "blocked_at", "domain"}
+"""User attributes which are counted by the user counters of the domains."""
+
+
+def _role_user_ids(session, role_ids):
+    """Collect the IDs of the users linked to the given roles.
+
+    Only the IDs are queried from the association table, without loading the
+    users themselves.
+    """
+    if not role_ids:
         return []
 
+    with session.no_autoflush:
+        query = (
+            select(userrole.c.user_id)
+            .where(userrole.c.role_id.in_(role_ids))
+            .distinct()
+        )
+        return session.execute(query).scalars().all()
+
+
+def _changed_attributes(item):
+    """Get the names of the attributes of a model object that were changed."""
+    return {attr.key for attr in sa_inspect(item).attrs if attr.history.has_changes()}
+
+
+def _is_low_priority_update(user):
+    """Check if only low-priority attributes of a user were changed."""
+    low_priority = current_app.config["USERS_RESOURCES_LOW_PRIORITY_USER_ATTRIBUTES"]
+    changed = _changed_attributes(user)
+    return bool(changed) and changed.issubset(low_priority)
+
+
+def _counter_domains(session):
+    """Get the domains whose user counters are affected by the changes."""
+    domains = set()
+    moved = []
+    # loading expired attributes must not flush the changes yet
+    with session.no_autoflush:
+        for item in chain(session.new, session.dirty, session.deleted):
+            if not isinstance(item, User):
+                continue
+            changed = _changed_attributes(item) if item in session.dirty else set()
+            if item in session.dirty and not (changed & COUNTER_ATTRIBUTES):
+                continue
+            domains.add(item.domain)
+            if "domain" in changed:
+                moved.append(item.id)
+
+        # users moving to another domain change the counters of both domains,
+        # and the previous domain is only known to the database
+        if moved:
+            query = select(User.domain).where(User.id.in_(moved))
+            domains.update(session.execute(query).scalars())
+
+    domains.discard(None)
+    return domains
+
+
+def _superadmin_changes(session):
+    """Find the changes which may affect the users with superadmin access.
+
+    Returns whether such changes were found, along with the changed actions
+    of users and roles (whose IDs may only be assigned by the flush).
+    """
+    changed, actions = False, []
+    with session.no_autoflush:
+        for item in chain(session.new, session.dirty, session.deleted):
+            if isinstance(item, (ActionUsers, ActionRoles)):
+                actions.append(item)
+            elif isinstance(item, Role) and item in session.deleted:
+                changed = True
+            elif isinstance(item, (User, Role)):
+                members = "roles" if isinstance(item, User) else "users"
+                changed |= sa_inspect(item).attrs[members].history.has_changes()
+    return changed or bool(actions), actions
+
 
 def pre_commit(sender, session):
     """Find out which entities need indexing before commit."""
@@ -32,21 +146,70 @@ def pre_commit(sender, session):
     # information here.
     # session is a scoped_session and does not have _model_changes,
     # so we have to rely only on .dirty
-    updated = session.dirty.union(session.new)
+    #
+    # the attribute history is only available before the flush; users with
+    # only low-priority changes (e.g. login bookkeeping) aren't reindexed
+    updated = [
+        item
+        for item in session.dirty.union(session.new)
+        if not (isinstance(item, User) and _is_low_priority_update(item))
+    ]
     deleted = session.deleted
     sid = id(session)
+
+    if current_app.config["USERS_RESOURCES_DOMAINS_UPDATE_COUNTERS_ON_CHANGE"]:
+        session.info[COUNTER_DOMAINS_KEY] = _counter_domains(session)
+
+    _, changed_actions = _superadmin_changes(session)
+
+    # the versions are only bumped for changes of the columns themselves,
+    # not e.g. for changes of the memberships
+    versioned = [
+        item
+        for item in updated
+        if isinstance(item, (User, Role))
+        and (
+            item in session.new or session.is_modified(item, include_collections=False)
+        )
+    ]
+
+    # the members of deleted roles can only be looked up before the flush,
+    # which removes the memberships along with the roles
+    deleted_role_ids = [item.id for item in deleted if isinstance(item, Role)]
+    for user_id in _role_user_ids(session, deleted_role_ids):
+        current_db_change_history.add_updated_user(sid, user_id)
+
     # flush the session s.t. related models are queryable
     session.flush()
 
+    # the users (or members of the roles) whose actions changed are
+    # reindexed, for their superadmin flag
+    for action in changed_actions:
+        if isinstance(action, ActionUsers) and action.user_id is not None:
+            current_db_change_history.add_updated_user(sid, action.user_id)
+        if isinstance(action, ActionRoles) and action.role_id is not None:
+            current_db_change_history.add_updated_role(sid, action.role_id)
+
+    session.info[DOMAINS_CHANGED_KEY] = any(
+        isinstance(item, Domain) for item in chain(updated, deleted)
+    )
+    session.info[VERSIONS_KEY] = {
+        "users": {
+            item.id: item.version_id for item in versioned if isinstance(item, User)
+        },
+        "groups": {
+            item.id: item.version_id for item in versioned if isinstance(item, Role)
+        },
+    }
+
     # users need to be reindexed if their user model was updated, or
     # their profile was changed (or even possibly deleted)
     for item in updated:
         if isinstance(item, User):
             current_db_change_history.add_updated_user(sid, item.id)
         if isinstance(item, Role):
+            # the members are reindexed asynchronously after the commit
             current_db_change_history.add_updated_role(sid, item.id)
-            for user_id in _role_user_ids(item):
-                current_db_change_history.add_updated_user(sid, user_id)
         if isinstance(item, Domain):
             current_db_change_history.add_updated_domain(sid, item.id)
 
@@ -55,11 +218,13 @@ def pre_commit(sender, session):
             current_db_change_history.add_deleted_user(sid, item.id)
         if isinstance(item, Role):
             current_db_change_history.add_deleted_role(sid, item.id)
-            for user_id in _role_user_ids(item):
-                current_db_change_history.add_updated_user(sid, user_id)
         if isinstance(item, Domain):
             current_db_change_history.add_deleted_domain(sid, item.id)
 
+    changes = current_db_change_history.sessions.get(sid)
+    if changes and current_app.config["USERS_RESOURCES_REINDEX_OUTBOX_ENABLED"]:
+        write_outbox(session, changes)
+
 
 def post_commit(sender, session):
     """Reindex all modified users and roles after the DB commit."""
@@ -67,34 +232,136 @@ def post_commit(sender, session):
     # DB operations are allowed here, not even lazy-loading of
     # properties!
     sid = id(session)
+    versions = session.info.pop(VERSIONS_KEY, {})
+
+    if session.info.pop(DOMAINS_CHANGED_KEY, False):
+        current_user_resources.domain_cache.invalidate()
+
+    counter_domains = session.info.pop(COUNTER_DOMAINS_KEY, None)
+    if counter_domains:
+        update_domain_counters.delay(sorted(counter_domains))
 
     if current_db_change_history.sessions.get(sid):
+        if current_app.config["USERS_RESOURCES_REINDEX_OUTBOX_ENABLED"]:
+            # the changes were written to the outbox, which is also processed
+            # periodically in case this fails
+            try:
+                process_reindex_outbox.delay()
+            except Exception:
+                current_app.logger.warning(
+                    "Could not trigger the processing of the reindex outbox.",
+                    exc_info=True,
+                )
+            return
+
         # Handle updates
         user_ids_updated = list(current_db_change_history.sessions[sid].updated_users)
         if user_ids_updated:
-            reindex_users.delay(user_ids_updated)
+            dispatch_reindex("users", user_ids_updated, versions.get("users"))
 
         group_ids_updated = list(current_db_change_history.sessions[sid].updated_roles)
         if group_ids_updated:
-            reindex_groups.delay(group_ids_updated)
+            dispatch_reindex("groups", group_ids_updated, versions.get("groups"))
+            reindex_group_members.delay(group_ids_updated)
 
         domain_ids_updated = list(
             current_db_change_history.sessions[sid].updated_domains
         )
         if domain_ids_updated:
-            reindex_domains.delay(domain_ids_updated)
+            dispatch_reindex("domains", domain_ids_updated)
 
         # Handle deletes
         user_ids_deleted = list(current_db_change_history.sessions[sid].deleted_users)
         if user_ids_deleted:
-            unindex_users.delay(user_ids_deleted)
+            dispatch_chunked(unindex_users, user_ids_deleted)
 
         group_ids_deleted = list(current_db_change_history.sessions[sid].deleted_roles)
         if group_ids_deleted:
-            unindex_groups.delay(group_ids_deleted)
+            dispatch_chunked(unindex_groups, group_ids_deleted)
 
         domain_ids_deleted = list(
             current_db_change_history.sessions[sid].deleted_domains
         )
         if domain_ids_deleted:
-            delete_domains.delay(domain_ids_deleted)
+            dispatch_chunked(delete_domains, domain_ids_deleted)
+
+
+def _add_superadmin_users(session, previous, current):
+    """Add the users whose superadmin access changed, to be reindexed."""
+    session.info.setdefault(SUPERADMIN_USERS_KEY, set()).update(previous ^ current)
+
+
+def superadmins_before_flush(session, flush_context, instances):
+    """Get the superadmin users before flushing changes which may affect them."""
+    if has_app_context() and _superadmin_changes(session)[0]:
+        session.info[PREVIOUS_SUPERADMINS_KEY] = query_superadmin_user_ids(session)
+
+
+def superadmins_after_flush(session, flush_context):
+    """Flag the flushed changes which may affect the superadmins."""
+    changed, actions = _superadmin_changes(session)
+    if changed:
+        session.info[SUPERADMINS_CHANGED_KEY] = True
+    if any(isinstance(action, ActionRoles) for action in actions) or any(
+        isinstance(item, Role) for item in session.deleted
+    ):
+        session.info[SUPERADMIN_ROLES_CHANGED_KEY] = True
+
+    previous = session.info.pop(PREVIOUS_SUPERADMINS_KEY, None)
+    if previous is not None:
+        _add_superadmin_users(session, previous, query_superadmin_user_ids(session))
+
+
+def superadmins_do_orm_execute(orm_execute_state):
+    """Flag the bulk statements which may affect the superadmins.
+
+    E.g. the access removed with ``invenio access remove``, which bypasses the
+    unit of work of the session. The superadmin users are compared before and
+    after the statement, as the affected rows aren't known.
+    """
+    state = orm_execute_state
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    table_name = getattr(getattr(state.statement, "table", None), "name", None)
+    if table_name in SUPERADMIN_TABLES:
+        state.session.info[SUPERADMINS_CHANGED_KEY] = True
+    if table_name in SUPERADMIN_ROLES_TABLES:
+        state.session.info[SUPERADMIN_ROLES_CHANGED_KEY] = True
+
+    if table_name in SUPERADMIN_TABLES and has_app_context():
+        previous = query_superadmin_user_ids(state.session)
+        result = state.invoke_statement()
+        current = query_superadmin_user_ids(state.session)
+        _add_superadmin_users(state.session, previous, current)
+        return result
+
+
+def superadmins_after_commit(session):
+    """Invalidate and reindex the superadmins after a commit affecting them.
+
+    Unlike the datastore hooks, this covers any commit of the session (e.g.
+    of ``invenio access allow``, or of bulk statements). The users whose
+    superadmin access changed are reindexed for their ``is_superadmin`` flag,
+    after the cached superadmins were invalidated.
+    """
+    changed = session.info.pop(SUPERADMINS_CHANGED_KEY, False)
+    roles_changed = session.info.pop(SUPERADMIN_ROLES_CHANGED_KEY, False)
+    user_ids = session.info.pop(SUPERADMIN_USERS_KEY, None)
+    if not has_app_context():
+        return
+    if changed:
+        invalidate_superadmin_user_ids()
+    if roles_changed:
+        invalidate_superadmin_role_ids()
+    if changed or roles_changed:
+        reset_permission_decisions()
+    if user_ids:
+        dispatch_reindex("users", sorted(user_ids))
+
+
+def superadmins_after_rollback(session):
+    """Drop the flagged changes of the superadmins, as they were rolled back."""
+    session.info.pop(SUPERADMINS_CHANGED_KEY, None)
+    session.info.pop(SUPERADMIN_ROLES_CHANGED_KEY, None)
+    session.info.pop(SUPERADMIN_USERS_KEY, None)
+    session.info.pop(PREVIOUS_SUPERADMINS_KEY, None)
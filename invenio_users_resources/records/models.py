@@ -5,6 +5,7 @@
 """Base model classes for user and group management in Invenio."""
 
 from abc import ABC, abstractmethod
+from datetime import datetime, timezone
 
 from flask import current_app
 from invenio_accounts.proxies import current_datastore
@@ -237,3 +238,82 @@ class DomainAggregateModel(AggregateMetadata):
             with db.session.no_autoflush:
                 self._model_obj = current_datastore.find_domain(domain)
         return self._model_obj
+
+
+class ReindexOutboxModel(db.Model):
+    """Entities of which the (un)indexing is pending.
+
+    Rows are written in the same transaction as the changes to the users,
+    groups and domains, and removed once the change has been indexed.
+    """
+
+    __tablename__ = "users_resources_reindex_outbox"
+
+    id = db.Column(
+        db.BigInteger().with_variant(db.Integer, "sqlite"),
+        primary_key=True,
+        autoincrement=True,
+    )
+    """Sequence number of the change."""
+
+    record_type = db.Column(db.String(16), nullable=False)
+    """Type of the entity, i.e. ``users``, ``groups`` or ``domains``."""
+
+    record_id = db.Column(db.String(255), nullable=False)
+    """ID of the entity."""
+
+    op = db.Column(db.String(16), nullable=False, default="index")
+    """Operation to apply, i.e. ``index`` or ``delete``."""
+
+    created = db.Column(
+        db.UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc)
+    )
+    """Time of the change."""
+
+
+class DomainBlocklistSourceModel(db.Model):
+    """State of the last import of a domain blocklist, per source."""
+
+    __tablename__ = "users_resources_blocklist_sources"
+
+    name = db.Column(db.String(255), primary_key=True)
+    """Name of the source, with which the domains are flagged."""
+
+    url = db.Column(db.Text, nullable=False)
+    """URL from which the blocklist was imported."""
+
+    hash = db.Column(db.String(64), nullable=True)
+    """SHA-256 hash of the (normalized) domains of the last complete import."""
+
+    etag = db.Column(db.String(255), nullable=True)
+    """``ETag`` of the last complete import, for conditional requests."""
+
+    last_modified = db.Column(db.String(64), nullable=True)
+    """``Last-Modified`` of the last complete import, for conditional requests."""
+
+    updated = db.Column(
+        db.UTCDateTime,
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+    """Time of the last import."""
+
+
+class DomainBlocklistEntryModel(db.Model):
+    """Domain of a blocklist, as of its last import.
+
+    The entries of a source are diffed against each new import, to find the
+    domains which were removed from the blocklist.
+    """
+
+    __tablename__ = "users_resources_blocklist_entries"
+
+    source = db.Column(db.String(255), primary_key=True)
+    """Name of the source of the blocklist."""
+
+    domain = db.Column(db.String(255), primary_key=True)
+    """Domain name, as normalized by the import."""
+
+    import_id = db.Column(db.String(32), nullable=False)
+    """ID of the last import which listed the domain."""
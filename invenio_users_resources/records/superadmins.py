@@ -0,0 +1,176 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Lookups of the users and roles with superadmin access."""
+
+from time import monotonic
+from uuid import uuid4
+
+from flask import current_app, has_request_context, request
+from invenio_access import ActionRoles, ActionUsers, superuser_access
+from invenio_accounts.models import userrole
+from invenio_cache import current_cache
+from invenio_db import db
+from sqlalchemy import and_, not_, select, union
+
+SUPERADMINS_CACHE_KEY = "users-resources:superadmins"
+"""Key of the IDs of the users with superadmin access in the cache."""
+
+SUPERADMIN_ROLES_GENERATION_KEY = "users-resources:superadmin-roles:generation"
+"""Key of the generation of the roles with superadmin access in the cache."""
+
+_superadmin_roles = None
+"""Generation, IDs and expiry time of the roles with superadmin access."""
+
+
+def _superuser_grants(exclude, user_id=None):
+    """Select the IDs of the users granted (or denied) superadmin access.
+
+    The access is granted (or denied) to users directly, or via their roles.
+    """
+    via_users = (
+        ActionUsers.query_by_action(superuser_access)
+        .with_entities(ActionUsers.user_id)
+        .filter(ActionUsers.user_id.isnot(None), ActionUsers.exclude.is_(exclude))
+    )
+    via_roles = (
+        ActionRoles.query_by_action(superuser_access)
+        .join(userrole, userrole.c.role_id == ActionRoles.role_id)
+        .with_entities(userrole.c.user_id)
+        .filter(ActionRoles.exclude.is_(exclude))
+    )
+    if user_id is not None:
+        via_users = via_users.filter(ActionUsers.user_id == user_id)
+        via_roles = via_roles.filter(userrole.c.user_id == user_id)
+    return union(via_users.statement, via_roles.statement)
+
+
+def query_superadmin_user_ids(session):
+    """Query the IDs of the users with superadmin access, bypassing the cache."""
+    granted = _superuser_grants(exclude=False).subquery()
+    query = select(granted.c.user_id).where(
+        granted.c.user_id.not_in(_superuser_grants(exclude=True))
+    )
+    return set(session.execute(query).scalars())
+
+
+def superadmin_user_ids():
+    """Get the IDs of the users with superadmin access, via roles or directly.
+
+    As for the permissions, the users who are denied the access (directly or
+    via roles) do not have it. The IDs are cached for ``USERS_RESOURCES_SUPERADMINS_CACHE_TIMEOUT``
+    seconds, and invalidated when the superadmin access of users or roles, or
+    the members of roles, are changed.
+    """
+    timeout = current_app.config["USERS_RESOURCES_SUPERADMINS_CACHE_TIMEOUT"]
+    user_ids = None
+    if timeout:
+        try:
+            user_ids = current_cache.get(SUPERADMINS_CACHE_KEY)
+        except Exception:
+            current_app.logger.warning(
+                "Could not get the cached superadmins.", exc_info=True
+            )
+    if user_ids is not None:
+        return set(user_ids)
+
+    user_ids = query_superadmin_user_ids(db.session)
+
+    if timeout:
+        try:
+            current_cache.set(SUPERADMINS_CACHE_KEY, sorted(user_ids), timeout=timeout)
+        except Exception:
+            current_app.logger.warning(
+                "Could not cache the superadmins.", exc_info=True
+            )
+    return user_ids
+
+
+def invalidate_superadmin_user_ids():
+    """Drop the cached IDs of the users with superadmin access."""
+    if has_request_context():
+        request._users_resources_superadmins = {}
+    try:
+        current_cache.delete(SUPERADMINS_CACHE_KEY)
+    except Exception:
+        current_app.logger.warning(
+            "Could not invalidate the cached superadmins.", exc_info=True
+        )
+
+
+def is_superadmin_user(user_id):
+    """Check if a user has superadmin access, directly or via roles.
+
+    This is a single query, rather than building the identity of the user,
+    and its result is memoised for the current request.
+    """
+    checked = None
+    if has_request_context():
+        checked = getattr(request, "_users_resources_superadmins", None)
+        if checked is None:
+            checked = request._users_resources_superadmins = {}
+        if user_id in checked:
+            return checked[user_id]
+
+    query = select(
+        and_(
+            _superuser_grants(exclude=False, user_id=user_id).exists(),
+            not_(_superuser_grants(exclude=True, user_id=user_id).exists()),
+        )
+    )
+    is_superadmin = bool(db.session.execute(query).scalar())
+    if checked is not None:
+        checked[user_id] = is_superadmin
+    return is_superadmin
+
+
+def superadmin_role_ids():
+    """Get the IDs of the roles with superadmin access.
+
+    The IDs are kept in memory for
+    ``USERS_RESOURCES_SUPERADMIN_ROLES_CACHE_TTL`` seconds. All processes drop
+    them whenever the superadmin access of roles changes, as signalled through
+    a generation in the shared cache.
+    """
+    global _superadmin_roles
+
+    ttl = current_app.config["USERS_RESOURCES_SUPERADMIN_ROLES_CACHE_TTL"]
+    if ttl:
+        try:
+            generation = current_cache.get(SUPERADMIN_ROLES_GENERATION_KEY)
+        except Exception:
+            current_app.logger.warning(
+                "Could not check the generation of the superadmin roles.",
+                exc_info=True,
+            )
+            ttl = 0
+
+    now = monotonic()
+    cached = _superadmin_roles
+    if ttl and cached is not None:
+        cached_generation, role_ids, expires = cached
+        if cached_generation == generation and now < expires:
+            return set(role_ids)
+
+    role_ids = frozenset(
+        str(role_id)
+        for (role_id,) in ActionRoles.query_by_action(superuser_access).with_entities(
+            ActionRoles.role_id
+        )
+    )
+    if ttl:
+        _superadmin_roles = (generation, role_ids, now + ttl)
+    return set(role_ids)
+
+
+def invalidate_superadmin_role_ids():
+    """Drop the IDs of the roles with superadmin access, in all processes."""
+    global _superadmin_roles
+
+    _superadmin_roles = None
+    try:
+        current_cache.set(SUPERADMIN_ROLES_GENERATION_KEY, uuid4().hex, timeout=0)
+    except Exception:
+        current_app.logger.warning(
+            "Could not invalidate the superadmin roles.", exc_info=True
+        )
@@ -5,11 +5,79 @@
 
 """Data-layer definitions for user and group management in Invenio."""
 
-from invenio_accounts.models import DomainOrg, UserIdentity
+from collections import defaultdict
+from contextvars import ContextVar
+
+from invenio_accounts.models import (
+    Domain,
+    DomainCategory,
+    DomainOrg,
+    UserIdentity,
+    userrole,
+)
 from invenio_accounts.proxies import current_datastore
 from invenio_accounts.utils import DomainStatus
 from invenio_db import db
 from invenio_records_resources.records.systemfields.calculated import CalculatedField
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from ...proxies import current_user_resources
+from ..superadmins import superadmin_user_ids
+
+_current_context = ContextVar("users_resources_calculation_context", default=None)
+
+
+class CalculationContext:
+    """Batch-scoped context for the calculated fields of a set of records.
+
+    Within the context, the calculated fields of the given records are resolved
+    via the fields' ``prefetch()`` hook, i.e. once for the whole batch rather
+    than once per record. The values are prefetched lazily, the first time a
+    field is accessed on any of the records.
+
+    .. code-block:: python
+
+        with CalculationContext(records):
+            dumps = [record.dumps() for record in records]
+
+    Records that are not part of the batch, as well as fields without a
+    ``prefetch()`` hook, are calculated as usual.
+    """
+
+    def __init__(self, records):
+        """Constructor."""
+        self._records = [record for record in records if record is not None]
+        self._values = {}
+        self._token = None
+
+    def __enter__(self):
+        """Activate the context."""
+        self._token = _current_context.set(self)
+        return self
+
+    def __exit__(self, *args):
+        """Deactivate the context."""
+        _current_context.reset(self._token)
+        self._token = None
+
+    @staticmethod
+    def current():
+        """Get the currently active context, if any."""
+        return _current_context.get()
+
+    def lookup(self, field, record):
+        """Look up the prefetched value of a field for a record.
+
+        Returns a ``(found, value)`` tuple.
+        """
+        if field not in self._values:
+            self._values[field] = field.prefetch(self._records)
+        values = self._values[field]
+        if values is None or record.id not in values:
+            return False, None
+        return True, values[record.id]
 
 
 class CalculatedIndexedField(CalculatedField):
@@ -20,6 +88,31 @@ class CalculatedIndexedField(CalculatedField):
         super().__init__(key, use_cache=use_cache)
         self._index = index
 
+    def obj(self, instance):
+        """Get the field value, from the calculation context if there is one."""
+        if self._use_cache:
+            obj = self._get_cache(instance)
+            if obj is not None:
+                return obj
+
+        context = CalculationContext.current()
+        if context is not None:
+            found, obj = context.lookup(self, instance)
+            if found:
+                if self._use_cache:
+                    self._set_cache(instance, obj)
+                return obj
+
+        return super().obj(instance)
+
+    def prefetch(self, records):
+        """Resolve the values of the field for a batch of records at once.
+
+        Returns a mapping of record IDs to values, or ``None`` if the values
+        should be calculated per record.
+        """
+        return None
+
     def pre_dump(self, record, data, dumper=None):
         """Called after a record is dumped."""
         if self._index:
@@ -78,12 +171,25 @@ class IsNotNoneField(CalculatedIndexedField):
         return getattr(user_record, self._field, None) is not None
 
 
+class IsSuperadminField(CalculatedIndexedField):
+    """Dump a bool for whether the user has superadmin access."""
+
+    def calculate(self, user_record):
+        """Check if the user is a superadmin."""
+        return user_record.id in superadmin_user_ids()
+
+    def prefetch(self, user_records):
+        """Look up the superadmins once for all the users."""
+        user_ids = superadmin_user_ids()
+        return {record.id: record.id in user_ids for record in user_records}
+
+
 class DomainField(CalculatedIndexedField):
     """Get information about the user's domain."""
 
-    def calculate(self, user_record):
-        """Checks if a timestamp is not none."""
-        domain = current_datastore.find_domain(user_record.domain)
+    @staticmethod
+    def dump_domain(domain):
+        """Dump the domain information for a ``Domain`` model object."""
         if domain is None:
             return {
                 "tld": "",
@@ -99,17 +205,96 @@ class DomainField(CalculatedIndexedField):
                 "flagged": domain.flagged,
             }
 
+    @classmethod
+    def resolve(cls, name, domain):
+        """Dump a domain, or else its closest flagged or blocked parent domain.
+
+        Domains without a status of their own (i.e. new and unflagged ones, or
+        unknown ones) get the status of their closest flagged or blocked
+        parent domain, e.g. ``mail.spam.com`` the one of ``spam.com``.
+        """
+        if domain is not None and (domain.flagged or domain.status != DomainStatus.new):
+            return cls.dump_domain(domain)
+
+        parent = None
+        if name:
+            parent = current_user_resources.domain_trie.match(name, include_self=False)
+        if parent is not None:
+            return dict(parent[1], tld=domain.tld if domain else parent[1]["tld"])
+        return cls.dump_domain(domain)
+
+    @classmethod
+    def dump_domains(cls, names):
+        """Dump the given domains, from the domain cache or the database.
+
+        :returns: The dumps of the domains, by their name.
+        """
+        cache = current_user_resources.domain_cache
+        if cache.sync():
+            # the inherited statuses of subdomains depend on the changed ones
+            current_user_resources.domain_trie.refresh(force=True)
+        dumps = cache.get_many(names)
+        missing = set(names) - set(dumps)
+        if missing:
+            query = select(
+                Domain.domain,
+                Domain.tld,
+                Domain.status,
+                Domain.category,
+                Domain.flagged,
+            ).where(Domain.domain.in_(missing))
+            domains = {row.domain: row for row in db.session.execute(query)}
+            fetched = {name: cls.resolve(name, domains.get(name)) for name in missing}
+            cache.set_many(fetched)
+            dumps.update(fetched)
+        return dumps
+
+    def calculate(self, user_record):
+        """Checks if a timestamp is not none."""
+        name = user_record.domain
+        if not name:
+            return self.dump_domain(None)
+        return dict(self.dump_domains([name])[name])
+
+    def prefetch(self, user_records):
+        """Fetch the domains of all users in one query, unless cached."""
+        dumps = self.dump_domains({r.domain for r in user_records if r.domain})
+        return {
+            record.id: (
+                dict(dumps[record.domain]) if record.domain else self.dump_domain(None)
+            )
+            for record in user_records
+        }
+
 
 class UserIdentitiesField(CalculatedIndexedField):
     """Get a user's different linked account identities."""
 
+    @staticmethod
+    def dump_identities(identities):
+        """Dump the method/identifier mapping for ``UserIdentity`` objects."""
+        return {i.method: i.id for i in identities}
+
     def calculate(self, user_record):
         """Checks if a timestamp is not none."""
         identities = (
             db.session.query(UserIdentity).filter_by(id_user=user_record.id).all()
         )
-        data = {i.method: i.id for i in identities}
-        return data
+        return self.dump_identities(identities)
+
+    def prefetch(self, user_records):
+        """Fetch the identities of all users in one query."""
+        user_ids = {record.id for record in user_records}
+        identities = defaultdict(list)
+        if user_ids:
+            for identity in db.session.query(UserIdentity).filter(
+                UserIdentity.id_user.in_(user_ids)
+            ):
+                identities[identity.id_user].append(identity)
+        return {
+            record.id: self.dump_identities(identities[record.id])
+            for record in user_records
+        }
 
 
 class UserRolesField(CalculatedIndexedField):
@@ -124,6 +309,35 @@ class UserRolesField(CalculatedIndexedField):
         ]
         return sorted(role_names)
 
+    def prefetch(self, user_records):
+        """Fetch the role names of all users in one query.
+
+        Users whose roles are already loaded are not queried again.
+        """
+        role_names = defaultdict(list)
+        missing = set()
+        for record in user_records:
+            user = record.model._model_obj
+            if user is not None and "roles" not in sa_inspect(user).unloaded:
+                role_names[record.id] = [role.name for role in user.roles]
+            else:
+                missing.add(record.id)
+
+        if missing:
+            role_model = current_datastore.role_model
+            query = (
+                db.session.query(userrole.c.user_id, role_model.name)
+                .join(role_model, role_model.id == userrole.c.role_id)
+                .filter(userrole.c.user_id.in_(missing))
+            )
+            for user_id, name in query:
+                role_names[user_id].append(name)
+
+        return {
+            record.id: sorted(n for n in role_names[record.id] if n is not None)
+            for record in user_records
+        }
+
 
 class DomainOrgField(CalculatedIndexedField):
     """Get information about the user's domain."""
@@ -133,7 +347,30 @@ class DomainOrgField(CalculatedIndexedField):
         if not domain_record.model.org_id:
             return None
 
-        org = domain_record.model.model_obj.org
+        return self.dump_org(domain_record.model.model_obj.org)
+
+    def prefetch(self, domain_records):
+        """Fetch the organisations (and their parents) in one query."""
+        org_ids = {record.model.org_id for record in domain_records}
+        org_ids.discard(None)
+        orgs = {}
+        if org_ids:
+            orgs = {
+                org.id: org
+                for org in db.session.query(DomainOrg)
+                .filter(DomainOrg.id.in_(org_ids))
+                .options(selectinload(DomainOrg.parent))
+            }
+        return {
+            record.id: self.dump_org(orgs.get(record.model.org_id))
+            for record in domain_records
+        }
+
+    @staticmethod
+    def dump_org(org):
+        """Dump an organisation, and its parent, for a ``DomainOrg`` object."""
+        if org is None:
+            return None
 
         parent_org = None
         if org.parent_id is not None:
@@ -171,6 +408,22 @@ class DomainCategoryNameField(CalculatedIndexedField):
         else:
             return None
 
+    def prefetch(self, domain_records):
+        """Fetch the category names in one query."""
+        category_ids = {
+            record.model.category for record in domain_records if record.model.category
+        }
+        labels = {}
+        if category_ids:
+            labels = dict(
+                db.session.query(DomainCategory.id, DomainCategory.label).filter(
+                    DomainCategory.id.in_(category_ids)
+                )
+            )
+        return {
+            record.id: labels.get(record.model.category) for record in domain_records
+        }
+
 
 class DomainStatusNameField(CalculatedIndexedField):
     """Dump the name of the category."""
@@ -4,7 +4,24 @@
 
 """Definitions that are used by both users and user groups services."""
 
+from datetime import datetime, timezone
+from inspect import getattr_static
+from itertools import chain
+from uuid import uuid4
+
+from celery import group
+from flask import current_app
+from invenio_cache import current_cache
+from invenio_db import db
 from invenio_records_resources.services import EndpointLink
+from invenio_search import current_search, current_search_client
+from invenio_search.engine import search
+from invenio_search.utils import build_alias_name, build_index_name, timestamp_suffix
+from sqlalchemy import func, select
+
+from ..proxies import current_user_resources
+from ..utils import chunked
+from .tasks import rebuild_index_partition
 
 
 class EndpointLinkWithId(EndpointLink):
@@ -29,3 +46,398 @@ def vars_func_set_querystring(func_qs=lambda obj, vars: {}):
         vars["args"].update(func_qs(obj, vars))
 
     return _inner
+
+
+class RebuildIndexMixin:
+    """Streaming and partitioned rebuild of the index of a service.
+
+    By default, the IDs of all entities are streamed from the database into
+    the indexer queue, in keyset-paginated batches. In the partitioned mode,
+    the ID space is split into ranges of
+    ``USERS_RESOURCES_REBUILD_INDEX_PARTITION_SIZE`` entities (of which only
+    the boundaries are kept), each of which is reindexed by a separate task.
+    The progress is tracked in the cache, so that an interrupted rebuild can
+    be resumed with the ranges that were not completed yet.
+    """
+
+    id_column = None
+    """Model column identifying the entities, used for the partitioning."""
+
+    @property
+    def _id_column(self):
+        """The ID column, as accessing it on the service would bind it.
+
+        E.g. the hybrid ``Role.id`` would be evaluated against the service.
+        """
+        return getattr_static(type(self), "id_column")
+
+    @property
+    def _model_cls(self):
+        """The model class of the entities."""
+        return self._id_column.class_
+
+    def _stream_ids(self, *filters):
+        """Stream the ordered IDs of the entities, without materialising them."""
+        query = (
+            select(self._id_column)
+            .where(*filters)
+            .order_by(self._id_column)
+            .execution_options(yield_per=1000)
+        )
+        return db.session.execute(query).scalars()
+
+    def _id_batches(self, size, *filters):
+        """Iterate the ordered IDs of the entities in batches of ``size``.
+
+        The batches are paginated by keyset (``id > last_id``), so that
+        neither the IDs nor a cursor are kept across batches.
+        """
+        last_id = None
+        while True:
+            query = select(self._id_column).where(*filters)
+            if last_id is not None:
+                query = query.where(self._id_column > last_id)
+            query = query.order_by(self._id_column).limit(size)
+            ids = db.session.execute(query).scalars().all()
+            if not ids:
+                return
+            yield ids
+            last_id = ids[-1]
+
+    def _partition_ranges(self, size):
+        """Split the ID space into ranges of at most ``size`` entities.
+
+        Only the boundaries of the ranges are queried, page by page.
+        """
+        ranges, last_id = [], None
+        while True:
+            page = select(self._id_column.label("id"))
+            if last_id is not None:
+                page = page.where(self._id_column > last_id)
+            page = page.order_by(self._id_column).limit(size).subquery()
+            query = select(func.min(page.c.id), func.max(page.c.id))
+            start, end = db.session.execute(query).one()
+            if end is None:
+                return ranges
+            ranges.append((start, end))
+            last_id = end
+
+    def _rebuild_cache_key(self, *parts):
+        """Cache key for the state of the partitioned rebuild."""
+        return ":".join(["users-resources", "rebuild", self.id, *map(str, parts)])
+
+    def rebuild_index(self, identity, uow=None, partitioned=False, resume=False):
+        """Reindex all entities managed by this service.
+
+        :param partitioned: Reindex the entities in parallel, one task per
+            range of IDs.
+        :param resume: Only reindex the ranges that were not completed by the
+            last partitioned rebuild.
+        """
+        if not (partitioned or resume):
+            batch_size = current_app.config["USERS_RESOURCES_REINDEX_CHUNK_SIZE"]
+            ids = chain.from_iterable(self._id_batches(batch_size))
+            self.indexer.bulk_index(ids)
+            return True
+
+        timeout = current_app.config["USERS_RESOURCES_REBUILD_INDEX_CACHE_TIMEOUT"]
+        plan = current_cache.get(self._rebuild_cache_key()) if resume else None
+        if plan is None:
+            size = current_app.config["USERS_RESOURCES_REBUILD_INDEX_PARTITION_SIZE"]
+            plan = {"id": uuid4().hex, "ranges": self._partition_ranges(size)}
+            current_cache.set(self._rebuild_cache_key(), plan, timeout=timeout)
+
+        done = self._partitions_done(plan)
+        group(
+            rebuild_index_partition.si(self.id, plan["id"], index, start, end)
+            for index, (start, end) in enumerate(plan["ranges"])
+            if not done[index]
+        ).apply_async()
+        return True
+
+    def _partitions_done(self, plan):
+        """Get the completion flags of the partitions of a rebuild plan."""
+        if not plan["ranges"]:
+            return []
+        keys = [
+            self._rebuild_cache_key(plan["id"], index)
+            for index in range(len(plan["ranges"]))
+        ]
+        return [bool(value) for value in current_cache.get_many(*keys)]
+
+    def reindex_partition(self, start, end):
+        """Reindex the entities with IDs between ``start`` and ``end``."""
+        batch_size = current_app.config["USERS_RESOURCES_REINDEX_CHUNK_SIZE"]
+        filters = [self._id_column >= start, self._id_column <= end]
+        for chunk in self._id_batches(batch_size, *filters):
+            self.indexer.bulk_index_records(self.record_cls.get_records(chunk))
+
+    def mark_partition_done(self, plan_id, index):
+        """Record the completion of a partition of a rebuild."""
+        timeout = current_app.config["USERS_RESOURCES_REBUILD_INDEX_CACHE_TIMEOUT"]
+        current_cache.set(self._rebuild_cache_key(plan_id, index), 1, timeout=timeout)
+
+    def rebuild_index_progress(self):
+        """Get the progress of the last partitioned rebuild, if any."""
+        plan = current_cache.get(self._rebuild_cache_key())
+        if plan is None:
+            return None
+        return {
+            "total": len(plan["ranges"]),
+            "done": sum(self._partitions_done(plan)),
+        }
+
+    def reindex_updated(self, identity, since=None):
+        """Reindex the entities updated since the last run.
+
+        The entities with an ``updated`` timestamp after the watermark are
+        streamed in ID order and reindexed in bulk. The watermark is only
+        moved forward when all of them were indexed, so that failures are
+        retried by the next run. As the documents are indexed with their
+        revision ID as external version, running it repeatedly is harmless.
+
+        :param since: Reindex the entities updated since this time, instead
+            of the stored watermark. Without either, all entities are
+            reindexed.
+        :returns: A tuple with the number of indexed and failed entities.
+        """
+        key = self._rebuild_cache_key("watermark")
+        if since is None:
+            since = current_cache.get(key)
+
+        # transactions which are still running have set their timestamps
+        # before the start of this run, hence the overlap
+        overlap = current_app.config["USERS_RESOURCES_REINDEX_WATERMARK_OVERLAP"]
+        started = datetime.now(timezone.utc) - overlap
+
+        filters = [] if since is None else [self._model_cls.updated >= since]
+        indexed, failed = self._reindex_ids_into(self._stream_ids(*filters))
+        if not failed:
+            current_cache.set(key, started, timeout=0)
+        return indexed, failed
+
+    @property
+    def _rebuild_queue(self):
+        """Queue of the IDs reindexed while the index is rebuilt, if enabled."""
+        return current_user_resources.rebuild_queues.get(self.id)
+
+    def record_rebuild_changes(self, ids):
+        """Record the IDs of the entities reindexed during a rebuild.
+
+        Called by the reindexing tasks, as not all the changes which they
+        reindex update the entities themselves (e.g. the superadmin access of
+        a user, or the status of their domain), so they would be missed by
+        replaying the updated entities.
+        Only done if ``USERS_RESOURCES_REBUILD_INDEX_REPLAY_ENABLED``.
+        """
+        if self._rebuild_queue is None:
+            return
+        try:
+            if current_cache.get(self._rebuild_cache_key("running")):
+                self._rebuild_queue.add(ids)
+        except Exception:
+            current_app.logger.warning(
+                f"Could not record the {self.id} changed during the rebuild.",
+                exc_info=True,
+            )
+
+    def _replay_rebuild_changes_into(self, index):
+        """Reindex the entities recorded during the rebuild into an index."""
+        if self._rebuild_queue is None:
+            return
+        batch_size = current_app.config["USERS_RESOURCES_REINDEX_CHUNK_SIZE"]
+        id_type = self._id_column.type.python_type
+        while ids := self._rebuild_queue.pop(batch_size):
+            self._reindex_ids_into([id_type(id_) for id_ in ids], index)
+
+    def rebuild_index_with_alias_swap(self, identity, delete_old_index=False):
+        """Rebuild the index into a new physical index and swap the aliases.
+
+        The live index keeps serving (and receiving) the changes while the
+        new index is built with bulk-loading settings. The new index then
+        replaces the old one in the search and write aliases, and the
+        entities updated, reindexed (see ``record_rebuild_changes()``, if
+        enabled) or deleted during the build are replayed into it.
+
+        :param delete_old_index: Delete the old index after the swap.
+        :returns: The name of the new index.
+        """
+        client = current_search_client
+        index = self.record_cls.index
+        write_alias = build_alias_name(index._name)
+        search_alias = build_alias_name(index.search_alias)
+        aliases = {write_alias, search_alias}
+        old_names = ",".join(client.indices.get_alias(name=write_alias))
+        old_indices = {
+            name: set(value["aliases"]) & aliases
+            for name, value in client.indices.get_alias(index=old_names).items()
+        }
+
+        (new_index, _), _ = current_search.create_index(
+            index._name, suffix=timestamp_suffix(), create_write_alias=False
+        )
+        settings = client.indices.get_settings(index=new_index)
+        settings = settings[new_index]["settings"]["index"]
+        client.indices.put_settings(
+            index=new_index,
+            body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}},
+        )
+
+        # the IDs left over by an interrupted rebuild are outdated
+        if self._rebuild_queue is not None:
+            self._rebuild_queue.pop(len(self._rebuild_queue))
+        running_key = self._rebuild_cache_key("running")
+        timeout = current_app.config["USERS_RESOURCES_REBUILD_INDEX_CACHE_TIMEOUT"]
+        current_cache.set(running_key, True, timeout=timeout)
+        try:
+            started = datetime.now(timezone.utc)
+            self._reindex_ids_into(self._stream_ids(), new_index)
+
+            # replay the changes made during the build, before and after the
+            # swap (as until then, the changes are only written to the old
+            # index)
+            replayed = datetime.now(timezone.utc)
+            self._reindex_updated_into(started, new_index)
+            self._replay_rebuild_changes_into(new_index)
+
+            client.indices.put_settings(
+                index=new_index,
+                body={
+                    "index": {
+                        "refresh_interval": settings.get("refresh_interval"),
+                        "number_of_replicas": settings.get("number_of_replicas"),
+                    }
+                },
+            )
+            client.indices.refresh(index=new_index)
+
+            actions = [
+                {"remove": {"index": name, "alias": alias}}
+                for name, index_aliases in old_indices.items()
+                for alias in index_aliases
+            ]
+            actions += [
+                {"add": {"index": new_index, "alias": alias}} for alias in aliases
+            ]
+            client.indices.update_aliases(body={"actions": actions})
+
+            self._reindex_updated_into(replayed, new_index)
+            self._replay_rebuild_changes_into(new_index)
+            self._remove_deleted_from(new_index)
+        finally:
+            current_cache.delete(running_key)
+
+        if delete_old_index and old_indices:
+            client.indices.delete(index=",".join(old_indices))
+        return new_index
+
+    def _reindex_ids_into(self, ids, index=None):
+        """Reindex the entities with the given IDs, in batches.
+
+        :param index: Physical index to write to, instead of the write alias.
+        :returns: A tuple with the number of indexed and failed entities.
+        """
+        batch_size = current_app.config["USERS_RESOURCES_REINDEX_CHUNK_SIZE"]
+        indexed = failed = 0
+        for chunk in chunked(ids, batch_size):
+            records = self.record_cls.get_records(chunk)
+            ok, failed_ids = self.indexer.bulk_index_records(records, index=index)
+            indexed += ok
+            failed += len(failed_ids)
+        return indexed, failed
+
+    def _reindex_updated_into(self, since, index):
+        """Reindex the entities updated since a given time into an index."""
+        ids = self._stream_ids(self._model_cls.updated >= since)
+        self._reindex_ids_into(ids, index)
+
+    def _orphaned_ids(self, index):
+        """Iterate the IDs in an index which no longer exist, in batches."""
+        # deletions leave no trace in the database, so the IDs in the index
+        # are compared against the ones in the database instead
+        batch_size = current_app.config["USERS_RESOURCES_REINDEX_CHUNK_SIZE"]
+        hits = search.helpers.scan(
+            current_search_client, index=index, _source=False, size=batch_size
+        )
+        id_type = self._id_column.type.python_type
+        for chunk in chunked((hit["_id"] for hit in hits), batch_size):
+            ids = [id_type(id_) for id_ in chunk]
+            query = select(self._id_column).where(self._id_column.in_(ids))
+            existing = {str(id_) for id_ in db.session.execute(query).scalars()}
+            orphaned = [id_ for id_ in chunk if id_ not in existing]
+            if orphaned:
+                yield orphaned
+
+    def _delete_ids_from(self, index, ids):
+        """Delete the documents with the given IDs from an index."""
+        search.helpers.bulk(
+            current_search_client,
+            [{"_op_type": "delete", "_index": index, "_id": id_} for id_ in ids],
+            raise_on_error=False,
+        )
+
+    def _remove_deleted_from(self, index):
+        """Remove the entities which no longer exist from an index."""
+        current_search_client.indices.refresh(index=index)
+        for ids in self._orphaned_ids(index):
+            self._delete_ids_from(index, ids)
+
+    def check_index_consistency(self, identity, repair=False):
+        """Compare the indexed documents against the database.
+
+        The entities are walked in batches of IDs and their documents are
+        fetched with one ``mget`` per batch. Documents that are missing, or
+        that are older than the entity (by revision ID or by their
+        ``indexed_at`` stamp) are reported, as are documents of entities that
+        no longer exist.
+
+        :param repair: Queue the missing and stale entities for indexing and
+            delete the orphaned documents.
+        :returns: The number of checked entities and of inconsistencies found.
+        """
+        client = current_search_client
+        index = build_alias_name(self.record_cls.index._name)
+        batch_size = current_app.config["USERS_RESOURCES_REINDEX_CHUNK_SIZE"]
+        report = {"checked": 0, "missing": 0, "stale": 0, "orphaned": 0}
+
+        for chunk in chunked(self._stream_ids(), batch_size):
+            records = [r for r in self.record_cls.get_records(chunk) if r is not None]
+            if not records:
+                continue
+            docs = client.mget(
+                index=index,
+                body={"ids": [str(record.id) for record in records]},
+                _source_includes=["indexed_at"],
+            )["docs"]
+
+            missing = [r.id for r, doc in zip(records, docs) if not doc.get("found")]
+            stale = [
+                record.id
+                for record, doc in zip(records, docs)
+                if doc.get("found") and self._is_stale(record, doc)
+            ]
+            report["checked"] += len(records)
+            report["missing"] += len(missing)
+            report["stale"] += len(stale)
+            if repair and (missing or stale):
+                self.indexer.bulk_index(missing + stale)
+
+        for ids in self._orphaned_ids(index):
+            report["orphaned"] += len(ids)
+            if repair:
+                self._delete_ids_from(index, ids)
+
+        return report
+
+    @staticmethod
+    def _is_stale(record, doc):
+        """Check if an indexed document is older than its entity."""
+        if doc.get("_version", 0) < record.revision_id:
+            return True
+
+        # not all the aggregates are dumped with the indexing time
+        indexed_at = doc.get("_source", {}).get("indexed_at")
+        updated = record.model.updated
+        if indexed_at is None or updated is None:
+            return False
+        return datetime.fromisoformat(indexed_at) < updated
@@ -7,6 +7,17 @@
 from invenio_accounts.models import DomainOrg
 from invenio_db import db
 from invenio_records_resources.services.records.components import ServiceComponent
+from invenio_records_resources.services.uow import Operation
+
+from ...proxies import current_user_resources
+
+
+class DomainCacheInvalidateOp(Operation):
+    """Drop the cached information about domains, after the commit."""
+
+    def on_commit(self, uow):
+        """Invalidate the domain cache."""
+        current_user_resources.domain_cache.invalidate()
 
 
 class DomainComponent(ServiceComponent):
@@ -22,6 +33,7 @@ class DomainComponent(ServiceComponent):
         record.flagged_source = data.get("flagged_source", "")
         record.category = data.get("category", None)
         self._handle_org(data, record)
+        self.uow.register(DomainCacheInvalidateOp())
 
     def update(self, identity, data=None, record=None, **kwargs):
         """Inject update fields into the domain."""
@@ -35,6 +47,11 @@ class DomainComponent(ServiceComponent):
         record.flagged_source = data.get("flagged_source", record.flagged_source)
         record.category = data.get("category", record.category)
         self._handle_org(data, record)
+        self.uow.register(DomainCacheInvalidateOp())
+
+    def delete(self, identity, record=None, **kwargs):
+        """Drop the deleted domain from the domain cache."""
+        self.uow.register(DomainCacheInvalidateOp())
 
     def _handle_org(self, data, record):
         # Handle organisation
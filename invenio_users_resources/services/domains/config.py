@@ -29,6 +29,7 @@ from invenio_records_resources.services.records.queryparser import QueryParser
 
 from ...records.api import DomainAggregate
 from ..common import vars_func_set_querystring
+from ..indexer import AggregateIndexer
 from ..permissions import DomainPermissionPolicy
 from ..schemas import DomainSchema
 from .components import DomainComponent
@@ -76,6 +77,7 @@ class DomainsServiceConfig(RecordServiceConfig, ConfiguratorMixin):
     service_id = "domains"
     record_cls = DomainAggregate
     schema = DomainSchema
+    indexer_cls = AggregateIndexer
     indexer_queue_name = "domains"
     index_dumper = None
 
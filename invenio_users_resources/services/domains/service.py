@@ -7,15 +7,13 @@
 """Domains service."""
 
 from invenio_accounts.models import Domain
-from invenio_db import db
 from invenio_records_resources.services import RecordService
 
+from ..common import RebuildIndexMixin
 
-class DomainsService(RecordService):
+
+class DomainsService(RebuildIndexMixin, RecordService):
     """Domains service."""
 
-    def rebuild_index(self, identity, uow=None):
-        """Reindex all user groups managed by this service."""
-        domains = db.session.query(Domain.domain).yield_per(1000)
-        self.indexer.bulk_index([r[0] for r in domains])
-        return True
+    id_column = Domain.id
+    """Model column identifying the entities."""
@@ -4,36 +4,155 @@
 
 """Domains service tasks."""
 
+from datetime import datetime, timezone
+from hashlib import sha256
+from tempfile import TemporaryFile
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+from uuid import uuid4
+
 import requests
 from celery import shared_task
 from flask import current_app
 from invenio_accounts.models import Domain, DomainCategory, DomainStatus, User
 from invenio_db import db
 from invenio_search.engine import search
+from sqlalchemy import delete, func, insert, or_, select, update
 
-from ...proxies import current_domains_service, current_users_service
+from ...proxies import current_domains_service, current_user_resources
+from ...records.models import DomainBlocklistEntryModel, DomainBlocklistSourceModel
+from ...utils import chunked, dispatch_chunked
+from ..users.tasks import reindex_users
 
 
-@shared_task(ignore_result=True)
-def reindex_domains(domain_ids):
-    """Reindex the given domains."""
+def _retry_failed(task, failed, action):
+    """Retry a domains task for the IDs which could not be (un)indexed.
+
+    The task is only retried when run by a worker, as its result is ignored.
+    When called directly (e.g. by the reindex outbox), the IDs are returned.
+    """
+    if failed:
+        current_app.logger.warning(
+            f"Could not {action} {len(failed)} domains.", extra={"ids": failed}
+        )
+        if not task.request.called_directly:
+            raise task.retry(args=[failed])
+    return failed
+
+
+@shared_task(
+    bind=True,
+    ignore_result=True,
+    autoretry_for=(search.exceptions.ConnectionError,),
+    retry_backoff=True,
+)
+def reindex_domains(self, domain_ids):
+    """Reindex the given domains.
+
+    :returns: The IDs of the domains which could not be reindexed, i.e. all
+        of them if the index does not exist. Those are retried instead when
+        the task is run by a worker.
+    """
+    current_domains_service.record_rebuild_changes(domain_ids)
     index = current_domains_service.record_cls.index
-    if current_domains_service.indexer.exists(index):
-        try:
-            current_domains_service.indexer.bulk_index(domain_ids)
-        except search.exceptions.ConflictError as e:
-            current_app.logger.warn(f"Could not bulk-reindex groups: {e}")
+    if not current_domains_service.indexer.exists(index):
+        failed = [str(domain_id) for domain_id in domain_ids]
+        return _retry_failed(self, failed, "reindex")
+    try:
+        current_domains_service.indexer.bulk_index(domain_ids)
+    except search.exceptions.ConflictError as e:
+        current_app.logger.warn(f"Could not bulk-reindex groups: {e}")
+    return []
 
 
-@shared_task(ignore_result=True)
-def delete_domains(domain_ids):
-    """Delete domains from index."""
+@shared_task(
+    bind=True,
+    ignore_result=True,
+    autoretry_for=(search.exceptions.ConnectionError,),
+    retry_backoff=True,
+)
+def delete_domains(self, domain_ids):
+    """Delete domains from index.
+
+    :returns: The IDs of the domains which could not be deleted, i.e. all of
+        them if the index does not exist. Those are retried instead when the
+        task is run by a worker.
+    """
     index = current_domains_service.record_cls.index
-    if current_domains_service.indexer.exists(index):
-        try:
-            current_domains_service.indexer.bulk_delete(domain_ids)
-        except search.exceptions.ConflictError as e:
-            current_app.logger.warn(f"Could not bulk-unindex groups: {e}")
+    if not current_domains_service.indexer.exists(index):
+        failed = [str(domain_id) for domain_id in domain_ids]
+        return _retry_failed(self, failed, "unindex")
+    try:
+        current_domains_service.indexer.bulk_delete(domain_ids)
+    except search.exceptions.ConflictError as e:
+        current_app.logger.warn(f"Could not bulk-unindex groups: {e}")
+    return []
+
+
+DOMAIN_COUNTERS = (
+    "num_users",
+    "num_active",
+    "num_inactive",
+    "num_confirmed",
+    "num_verified",
+    "num_blocked",
+)
+"""Columns of the domains, which count the users of the domain."""
+
+
+def _domain_counters_query(domains=None):
+    """Query the domains whose user counters are out of date.
+
+    The counters of all the (given) domains are aggregated from the users
+    with a single ``GROUP BY`` query, and compared with the stored ones.
+    Domains without any users are counted as such.
+    """
+    counts = select(
+        User.domain.label("domain"),
+        func.count(User.id).label("num_users"),
+        func.count(User.id).filter(User.active.is_(True)).label("num_active"),
+        func.count(User.id).filter(User.active.is_(False)).label("num_inactive"),
+        func.count(User.confirmed_at).label("num_confirmed"),
+        func.count(User.verified_at).label("num_verified"),
+        func.count(User.blocked_at).label("num_blocked"),
+    ).group_by(User.domain)
+    if domains is not None:
+        counts = counts.where(User.domain.in_(domains))
+    counts = counts.subquery("counts")
+
+    columns = {name: func.coalesce(counts.c[name], 0) for name in DOMAIN_COUNTERS}
+    query = (
+        select(Domain.id, *(column.label(name) for name, column in columns.items()))
+        .outerjoin(counts, Domain.domain == counts.c.domain)
+        .where(or_(*(getattr(Domain, name) != columns[name] for name in columns)))
+    )
+    if domains is not None:
+        query = query.where(Domain.domain.in_(domains))
+    return query
+
+
+@shared_task(ignore_result=True)
+def update_domain_counters(domains=None):
+    """Recompute the user counters of the domains.
+
+    Only the domains whose counters changed are updated (with one bulk
+    update per batch) and reindexed.
+
+    :param domains: Only recompute the counters of these domain names,
+        e.g. of the domains of changed users.
+    :returns: The number of updated domains.
+    """
+    # the changed domains are read first, to not modify the table being read
+    rows = db.session.execute(_domain_counters_query(domains)).mappings().all()
+
+    batch_size = current_app.config["USERS_RESOURCES_REINDEX_CHUNK_SIZE"]
+    now = datetime.now(timezone.utc)
+    for batch in chunked(rows, batch_size):
+        db.session.execute(update(Domain), [{**row, "updated": now} for row in batch])
+        db.session.commit()
+        dispatch_chunked(reindex_domains, [row["id"] for row in batch])
+
+    return len(rows)
 
 
 @shared_task
@@ -43,57 +162,413 @@ def import_domain_blocklist(url, source_name):
     Marks domain as a spammer and blocks account registration from that domain.
     If domain already exists, it simply flags the domain, but does not block
     the domain.
+
+    The state of the last import is kept per source in the database, i.e. the
+    validators and hash of the blocklist, and the domains it listed. The
+    blocklist is only downloaded if it was modified since, and spooled to a
+    temporary file while it's hashed. Unless its hash is unchanged, it is then
+    streamed in batches, and only the domains which were added to it are
+    processed. Afterwards, the domains which are no longer listed are
+    unflagged if they were flagged by this source (but not unblocked).
+
+    The domains are processed in batches, with one lookup, one bulk insert
+    and one bulk update per batch, which is committed on its own along with
+    the listed domains of the source.
+
+    :returns: The number of created, updated, removed, unchanged and failed
+        domains.
+    """
+    counts = {"created": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0}
+    source = db.session.get(DomainBlocklistSourceModel, source_name)
+    state = {}
+    if source is not None and source.url == url:
+        state = {
+            "hash": source.hash,
+            "etag": source.etag,
+            "last_modified": source.last_modified,
+        }
+
+    lines, validators = download_blocklist(url, state)
+    if lines is None:
+        return counts
+
+    with TemporaryFile("w+", encoding="utf-8") as spool:
+        digest = sha256()
+        total = 0
+        for domain in _normalize_domains(lines):
+            spool.write(f"{domain}\n")
+            digest.update(f"{domain}\n".encode("utf-8"))
+            total += 1
+        digest = digest.hexdigest()
+
+        if digest == state.get("hash"):
+            current_app.logger.info(f"Domain blocklist {url} is unchanged.")
+            _save_blocklist_source(source_name, url, digest, validators)
+            counts["unchanged"] = total
+            return counts
+
+        spool.seek(0)
+        changed = _import_blocklist_domains(
+            (line.rstrip("\n") for line in spool), source_name, counts
+        )
+
+    current_app.logger.info(
+        "Imported domain blocklist {0}: {created} created, {updated} updated, "
+        "{removed} removed, {unchanged} unchanged, {failed} failed.".format(
+            url, **counts
+        )
+    )
+
+    # without a complete import, the blocklist is processed again next time
+    if counts["failed"]:
+        _save_blocklist_source(source_name, url)
+    else:
+        _save_blocklist_source(source_name, url, digest, validators)
+
+    if len(changed) > 0:
+        current_app.logger.info("Reindexing users in changed domains...")
+        reindex_domain_users(sorted(name for _, name in changed))
+
+    return counts
+
+
+def _import_blocklist_domains(domains, source_name, counts):
+    """Import the (streamed) domains of a blocklist, in batches.
+
+    The domains which were not listed by the last import are created or
+    flagged, and the ones which are no longer listed are unflagged. The
+    latter is skipped if any batch failed, as their domains would not be
+    marked as listed.
+
+    :returns: The ``(id, domain)`` pairs of the changed domains.
     """
     spammer_category = DomainCategory.get("spammer")
+    batch_size = current_app.config["USERS_RESOURCES_DOMAINS_BLOCKLIST_BATCH_SIZE"]
+    import_id = uuid4().hex
     changed = set()
 
-    for d in download_blocklist(url):
-        if d.endswith("."):
-            d = d[:-1]
-        domain = Domain.query.filter_by(domain=d).one_or_none()
-        if domain is None:
-            current_app.logger.info(f"Creating {d}")
-            try:
-                domain = Domain.create(
-                    d,
-                    status=DomainStatus.blocked,
-                    flagged=True,
-                    flagged_source=source_name,
-                    category=spammer_category.id,
+    for names in chunked(domains, batch_size):
+        names = set(names)
+        try:
+            listed = _listed_blocklist_domains(names, source_name)
+            added = names - listed
+            created, updated = [], []
+            if added:
+                created, updated = _import_blocklist_batch(
+                    added, source_name, spammer_category.id
                 )
-                db.session.commit()
-                changed.add((domain.id, d))
-            except Exception:
-                current_app.logger.error(f"Error creating domain {d}")
-                pass
-        elif domain.flagged != True:
-            current_app.logger.info(f"Updating ({domain.status}) {d}")
-            domain.flagged = True
-            domain.flagged_source = source_name
+            _mark_listed_blocklist_domains(source_name, import_id, listed, added)
             db.session.commit()
-            changed.add((domain.id, d))
+        except Exception:
+            db.session.rollback()
+            current_app.logger.error(
+                f"Error importing a batch of {len(names)} domains", exc_info=True
+            )
+            counts["failed"] += len(names)
+            continue
 
-    if len(changed) > 0:
-        current_app.logger.info("Reindexing changed domains...")
-        current_domains_service.indexer.bulk_index([x[0] for x in changed])
+        counts["created"] += len(created)
+        counts["updated"] += len(updated)
+        counts["unchanged"] += len(names) - len(created) - len(updated)
+        if created or updated:
+            current_domains_service.indexer.bulk_index(
+                [id_ for id_, _ in created + updated]
+            )
+            changed.update(created + updated)
 
-        current_app.logger.info("Reindexing users in changed domains...")
-        for dummy, d in changed:
-            users = db.session.query(User.id).filter(User.domain == d).yield_per(1000)
-            current_users_service.indexer.bulk_index([u.id for u in users])
+    if counts["failed"]:
+        return changed
+
+    for names in _unlisted_blocklist_domains(source_name, import_id, batch_size):
+        try:
+            unflagged = _unflag_blocklist_batch(names, source_name)
+            db.session.execute(
+                delete(DomainBlocklistEntryModel).where(
+                    DomainBlocklistEntryModel.source == source_name,
+                    DomainBlocklistEntryModel.domain.in_(names),
+                )
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.error(
+                f"Error unflagging a batch of {len(names)} domains", exc_info=True
+            )
+            counts["failed"] += len(names)
+            continue
 
+        counts["removed"] += len(unflagged)
+        if unflagged:
+            current_domains_service.indexer.bulk_index([id_ for id_, _ in unflagged])
+            changed.update(unflagged)
+
+    return changed
+
+
+def _listed_blocklist_domains(names, source_name):
+    """Get the given domains which were listed by the last import of a source."""
+    query = select(DomainBlocklistEntryModel.domain).where(
+        DomainBlocklistEntryModel.source == source_name,
+        DomainBlocklistEntryModel.domain.in_(names),
+    )
+    return set(db.session.execute(query).scalars())
+
+
+def _mark_listed_blocklist_domains(source_name, import_id, listed, added):
+    """Mark the domains of a batch as listed by the current import."""
+    if listed:
+        db.session.execute(
+            update(DomainBlocklistEntryModel)
+            .where(
+                DomainBlocklistEntryModel.source == source_name,
+                DomainBlocklistEntryModel.domain.in_(listed),
+            )
+            .values(import_id=import_id),
+            execution_options={"synchronize_session": False},
+        )
+    if added:
+        db.session.execute(
+            insert(DomainBlocklistEntryModel.__table__),
+            [
+                {"source": source_name, "domain": name, "import_id": import_id}
+                for name in sorted(added)
+            ],
+        )
+
+
+def _unlisted_blocklist_domains(source_name, import_id, batch_size):
+    """Iterate the domains no longer listed by a source, in batches.
+
+    The batches are paginated by keyset, as the domains of each batch are
+    removed before the next one is queried (unless the batch failed).
+    """
+    last = None
+    while True:
+        query = select(DomainBlocklistEntryModel.domain).where(
+            DomainBlocklistEntryModel.source == source_name,
+            DomainBlocklistEntryModel.import_id != import_id,
+        )
+        if last is not None:
+            query = query.where(DomainBlocklistEntryModel.domain > last)
+        query = query.order_by(DomainBlocklistEntryModel.domain).limit(batch_size)
+        names = db.session.execute(query).scalars().all()
+        if not names:
+            return
+        yield names
+        last = names[-1]
+
+
+def _save_blocklist_source(source_name, url, digest=None, validators=None):
+    """Store the state of the last import of a blocklist."""
+    validators = validators or {}
+    source = db.session.get(DomainBlocklistSourceModel, source_name)
+    if source is None:
+        source = DomainBlocklistSourceModel(name=source_name)
+        db.session.add(source)
+    source.url = url
+    source.hash = digest
+    source.etag = validators.get("etag")
+    source.last_modified = validators.get("last_modified")
+    db.session.commit()
+
+
+def reindex_domain_users(domains):
+    """Reindex the users of the given domains, including their subdomains.
+
+    The users of subdomains are included, as they inherit the status of their
+    closest flagged or blocked parent domain. The lookup of these statuses is
+    refreshed first, and the cached domains are invalidated (which makes the
+    other processes refresh their lookup too).
+
+    The domains are expanded with their known subdomains, i.e. the ones in the
+    ``Domain`` table (which gets the domains of users once they confirm their
+    email address). The IDs of their users are then streamed with one ``IN``
+    query per batch of domains, and reindexed in chunks by parallel
+    ``reindex_users`` tasks.
+    """
+    current_user_resources.domain_trie.refresh(force=True)
+    current_user_resources.domain_cache.invalidate()
+
+    batch_size = current_app.config["USERS_RESOURCES_DOMAINS_BLOCKLIST_BATCH_SIZE"]
+    chunk_size = current_app.config["USERS_RESOURCES_REINDEX_CHUNK_SIZE"]
+    names = set(domains) | set(_known_subdomains(domains))
+    for batch in chunked(sorted(names), batch_size):
+        query = (
+            select(User.id)
+            .where(User.domain.in_(batch))
+            .execution_options(yield_per=chunk_size)
+        )
+        for user_ids in chunked(db.session.execute(query).scalars(), chunk_size):
+            reindex_users.delay(user_ids)
+
+
+def _known_subdomains(domains):
+    """Iterate the subdomains of the given domains, from the ``Domain`` table.
+
+    The domains with the same top-level domains are streamed once, and matched
+    by their parent domains rather than by a (leading wildcard) suffix query.
+    """
+    domains = set(domains)
+    tlds = {name.rsplit(".", 1)[-1] for name in domains}
+    query = (
+        select(Domain.domain)
+        .where(Domain.tld.in_(tlds))
+        .execution_options(yield_per=1000)
+    )
+    for name in db.session.execute(query).scalars():
+        labels = name.split(".")
+        if any(".".join(labels[i:]) in domains for i in range(1, len(labels))):
+            yield name
+
+
+def _normalize_domains(lines):
+    """Normalize the domain names of a blocklist, skipping empty lines.
+
+    Duplicates are not skipped here, but by the batches of the import.
+    """
+    for line in lines:
+        domain = line.strip().rstrip(".").lower()
+        if domain:
+            yield domain
+
+
+def _import_blocklist_batch(names, source_name, category_id):
+    """Create or flag the domains of a batch of the blocklist.
+
+    The domains are written with bulk statements, bypassing the ORM, so
+    they're not reindexed by the DB hooks.
+
+    :returns: The ``(id, domain)`` pairs of the created and updated domains.
+    """
+    existing = db.session.execute(
+        select(Domain.id, Domain.domain, Domain.flagged).where(Domain.domain.in_(names))
+    ).all()
+
+    updated = [(id_, name) for id_, name, flagged in existing if not flagged]
+    if updated:
+        db.session.execute(
+            update(Domain)
+            .where(Domain.id.in_([id_ for id_, _ in updated]))
+            .values(
+                flagged=True,
+                flagged_source=source_name,
+                updated=datetime.now(timezone.utc),
+            ),
+            execution_options={"synchronize_session": False},
+        )
+
+    new = names - {name for _, name, _ in existing}
+    created = []
+    if new:
+        now = datetime.now(timezone.utc)
+        db.session.execute(
+            insert(Domain.__table__),
+            [
+                {
+                    "domain": name,
+                    "tld": name.split(".")[-1],
+                    "status": DomainStatus.blocked,
+                    "flagged": True,
+                    "flagged_source": source_name,
+                    "category": category_id,
+                    "created": now,
+                    "updated": now,
+                }
+                for name in sorted(new)
+            ],
+        )
+        created = db.session.execute(
+            select(Domain.id, Domain.domain).where(Domain.domain.in_(new))
+        ).all()
+
+    return [tuple(row) for row in created], updated
+
+
+def _unflag_blocklist_batch(names, source_name):
+    """Unflag the domains of a batch, that were flagged by the given source.
+
+    :returns: The ``(id, domain)`` pairs of the unflagged domains.
+    """
+    unflagged = db.session.execute(
+        select(Domain.id, Domain.domain).where(
+            Domain.domain.in_(names),
+            Domain.flagged.is_(True),
+            Domain.flagged_source == source_name,
+        )
+    ).all()
+    if unflagged:
+        db.session.execute(
+            update(Domain)
+            .where(Domain.id.in_([id_ for id_, _ in unflagged]))
+            .values(
+                flagged=False, flagged_source="", updated=datetime.now(timezone.utc)
+            ),
+            execution_options={"synchronize_session": False},
+        )
+    return [tuple(row) for row in unflagged]
+
+
+def download_blocklist(url, state=None):
+    """Download domain blocklist from a given URL.
+
+    Besides HTTP(S), local files can be read with ``file://`` URLs.
+
+    :param state: The state of the previous import of the blocklist, whose
+        ``etag`` and ``last_modified`` are used for a conditional request.
+    :returns: A tuple with the (streamed) lines of the blocklist (``None`` if
+        it was not modified, or could not be downloaded) and the new
+        validators. The response, or file, is closed once the lines were read.
+    """
+    state = state or {}
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        current_app.logger.info(f"Reading {url}...")
+        try:
+            fp = open(url2pathname(parsed.path), encoding="utf-8")
+        except OSError:
+            current_app.logger.error(f"Failed to read {url}", exc_info=True)
+            return None, {}
+        return _read_lines(fp), {}
+
+    headers = {}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
 
-def download_blocklist(url):
-    """Download domain blocklist from a given URL."""
     current_app.logger.info(f"Downloading {url}...")
-    response = requests.get(url)
+    response = requests.get(url, headers=headers, stream=True)
+    if response.status_code == 304:
+        response.close()
+        current_app.logger.info(f"Domain blocklist {url} was not modified.")
+        return None, {}
     if response.status_code != 200:
+        response.close()
         current_app.logger.error(
             f"Failed to download {url}",
             extra={"url": url, "status_code": response.status_code},
         )
-        return []
+        return None, {}
+
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    return _iter_response_lines(response), validators
+
+
+def _read_lines(fp):
+    """Read the lines of a file, closing it once they were read."""
+    with fp:
+        for line in fp:
+            yield line.rstrip()
+
 
-    # Parse file
-    content = response.content.decode("utf-8")
-    return {line.rstrip() for line in content.splitlines()}
+def _iter_response_lines(response):
+    """Parse a streamed response, line by line, closing it once they were read."""
+    try:
+        for line in response.iter_lines():
+            if line is not None:
+                yield line.decode("utf-8").rstrip()
+    finally:
+        response.close()
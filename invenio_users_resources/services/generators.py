@@ -12,14 +12,12 @@ from abc import abstractmethod
 from flask import current_app
 from invenio_access import (
     ActionRoles,
-    ActionUsers,
     Permission,
     any_user,
     superuser_access,
 )
 from invenio_access.models import Role
 from invenio_access.permissions import system_process
-from invenio_access.utils import get_identity
 from invenio_db import db
 from invenio_records.dictutils import dict_lookup
 from invenio_records_permissions.generators import (
@@ -30,6 +28,8 @@ from invenio_records_permissions.generators import (
 from invenio_search.engine import dsl
 from sqlalchemy import exists
 
+from ..records.superadmins import is_superadmin_user, superadmin_user_ids
+
 
 class IfPublic(ConditionalGenerator):
     """Generator for different permissions based on the visibility settings."""
@@ -233,11 +233,18 @@ class AdministrationAction(Generator):
         if not permission.allows(identity):
             return []
 
-        exclude_ids = self._records_to_exclude()
-        if not exclude_ids:
+        exclude_query = self._exclude_query()
+        if exclude_query is None:
             return dsl.Q("match_all")
 
-        return dsl.Q("match_all") & ~dsl.Q("terms", id=exclude_ids)
+        return dsl.Q("match_all") & ~exclude_query
+
+    def _exclude_query(self):
+        """Query of the records to exclude, if any."""
+        exclude_ids = self._records_to_exclude()
+        if not exclude_ids:
+            return None
+        return dsl.Q("terms", id=exclude_ids)
 
 
 class AdministrationUserAction(AdministrationAction):
@@ -245,20 +252,13 @@ class AdministrationUserAction(AdministrationAction):
 
     def _records_to_exclude(self):
         """Get IDs of users with superadmin access."""
-        # Users via role membership
-        users_via_roles = {
-            user.id
-            for action_role in ActionRoles.query_by_action(superuser_access).all()
-            for user in action_role.role.users
-        }
+        return list(superadmin_user_ids())
 
-        # Users with direct action assignments
-        users_via_actions = {
-            action_user.user_id
-            for action_user in ActionUsers.query_by_action(superuser_access).all()
-        }
-        # Return the union of both
-        return list(users_via_roles | users_via_actions)
+    def _exclude_query(self):
+        """Query of the superadmin users, via their indexed flag if enabled."""
+        if current_app.config["USERS_RESOURCES_SEARCH_SUPERADMIN_FLAG"]:
+            return dsl.Q("term", is_superadmin=True)
+        return super()._exclude_query()
 
 
 class AdministrationGroupAction(AdministrationAction):
@@ -296,8 +296,7 @@ class IfSuperAdmin(ConditionalGenerator):
         if isinstance(record.model.model_obj, Role):
             return self._is_role_superadmin(record)
 
-        record_identity = get_identity(record.model.model_obj)
-        return self._is_user_superadmin(record_identity)
+        return is_superadmin_user(record.model.model_obj.id)
 
     def _condition(self, record=None, identity=None, **kwargs):
         """Check if user or record has superadmin access."""
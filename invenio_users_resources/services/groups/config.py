@@ -24,6 +24,7 @@ from invenio_records_resources.services.records.queryparser import QueryParser
 
 from ...records.api import GroupAggregate
 from ..common import EndpointLinkWithId
+from ..indexer import AggregateIndexer
 from ..permissions import GroupsPermissionPolicy
 from ..schemas import GroupSchema
 from . import facets as groups_facets
@@ -90,6 +91,7 @@ class GroupsServiceConfig(RecordServiceConfig, ConfiguratorMixin):
     service_id = "groups"
     record_cls = GroupAggregate
     schema = GroupSchema
+    indexer_cls = AggregateIndexer
     indexer_queue_name = "groups"
     index_dumper = None
 
@@ -9,7 +9,6 @@
 
 from flask import current_app
 from invenio_accounts.models import Role
-from invenio_db import db
 from invenio_records_resources.resources.errors import PermissionDeniedError
 from invenio_records_resources.services import RecordService
 from invenio_records_resources.services.uow import (
@@ -21,12 +20,16 @@ from marshmallow import ValidationError
 
 from ...records.api import GroupAggregate
 from ...resources.groups.errors import GroupValidationError
+from ..common import RebuildIndexMixin
 from ..results import AvatarResult
 
 
-class GroupsService(RecordService):
+class GroupsService(RebuildIndexMixin, RecordService):
     """User groups service."""
 
+    id_column = Role.id
+    """Model column identifying the entities."""
+
     @unit_of_work()
     def create(self, identity, data, raise_errors=True, uow=None):
         """Create a new group/role."""
@@ -156,11 +159,3 @@ class GroupsService(RecordService):
             raise PermissionDeniedError()
         self.require_permission(identity, "read", record=group)
         return AvatarResult(group)
-
-    def rebuild_index(self, identity, uow=None):
-        """Reindex all user groups managed by this service."""
-        roles = db.session.query(Role.id).yield_per(1000)
-
-        self.indexer.bulk_index([r.id for r in roles])
-
-        return True
@@ -10,25 +10,59 @@ from invenio_search.engine import search
 
 from ...proxies import current_groups_service
 from ...records.api import GroupAggregate
+from ...utils import chunked
 
 
-@shared_task(ignore_result=True)
-def reindex_groups(group_ids):
-    """Reindex the given groups."""
-    index = current_groups_service.record_cls.index
-    if current_groups_service.indexer.exists(index):
-        try:
-            current_groups_service.indexer.bulk_index(group_ids)
-        except search.exceptions.ConflictError as e:
-            current_app.logger.warn(f"Could not bulk-reindex groups: {e}")
+@shared_task(
+    ignore_result=True,
+    autoretry_for=(search.exceptions.ConnectionError,),
+    retry_backoff=True,
+)
+def reindex_groups(group_ids, versions=None):
+    """Reindex the given groups.
+
+    :param versions: The versions committed for the groups, whose groups are
+        skipped if these versions were already indexed.
+    :returns: The IDs of the groups which could not be indexed, i.e. all of
+        them if the index does not exist.
+    """
+    current_groups_service.record_rebuild_changes(group_ids)
+    indexer = current_groups_service.indexer
+    if versions:
+        group_ids = indexer.filter_indexed(group_ids, versions)
+    if not group_ids:
+        return []
+    if not indexer.exists(current_groups_service.record_cls.index):
+        return [str(group_id) for group_id in group_ids]
 
+    failed = []
+    for ids in chunked(group_ids, indexer.batch_size):
+        groups = [g for g in GroupAggregate.get_records(ids) if g is not None]
+        _, failed_ids = indexer.bulk_index_records(groups)
+        if failed_ids:
+            current_app.logger.warning(
+                f"Could not bulk-reindex {len(failed_ids)} out of {len(groups)} groups."
+            )
+            failed.extend(failed_ids)
+    return failed
 
-@shared_task(ignore_result=True)
+
+@shared_task(
+    ignore_result=True,
+    autoretry_for=(search.exceptions.ConnectionError,),
+    retry_backoff=True,
+)
 def unindex_groups(group_ids):
-    """Unindex the given groups."""
+    """Unindex the given groups.
+
+    :returns: The IDs of the groups which could not be unindexed, i.e. all of
+        them if the index does not exist.
+    """
     index = current_groups_service.record_cls.index
-    if current_groups_service.indexer.exists(index):
-        try:
-            current_groups_service.indexer.bulk_delete(group_ids)
-        except search.exceptions.ConflictError as e:
-            current_app.logger.warn(f"Could not bulk-unindex groups: {e}")
+    if not current_groups_service.indexer.exists(index):
+        return [str(group_id) for group_id in group_ids]
+    try:
+        current_groups_service.indexer.bulk_delete(group_ids)
+    except search.exceptions.ConflictError as e:
+        current_app.logger.warn(f"Could not bulk-unindex groups: {e}")
+    return []
@@ -0,0 +1,230 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Indexer for the user, group and domain aggregates."""
+
+from time import monotonic
+
+from flask import current_app
+from invenio_cache import current_cache
+from invenio_indexer.api import RecordIndexer
+from invenio_search.engine import dsl, search
+from invenio_search.utils import build_alias_name
+from sqlalchemy.orm.exc import NoResultFound
+
+from ..records.systemfields import CalculationContext
+from ..utils import chunked
+
+_index_exists = {}
+"""Process-local cache of index existence, shared by the indexers."""
+
+
+class AggregateIndexer(RecordIndexer):
+    """Record indexer that processes the bulk queue in batches.
+
+    The aggregates of a batch of messages are fetched with the record class'
+    ``get_records()`` and dumped within a ``CalculationContext``, so that
+    their calculated fields are resolved with one query per batch instead of
+    one query per record.
+    """
+
+    batch_size = 500
+    """Number of messages that are processed together."""
+
+    def _index_name(self, index=None):
+        """Get the name of the (aliased) index."""
+        if not index:
+            index = self.record_cls.index
+        if isinstance(index, dsl.Index):
+            index = index._name
+        return build_alias_name(index)
+
+    def exists(self, index=None, **kwargs):
+        """Check if an index exists, cached for a short time.
+
+        The existence of the index is checked by every (un)indexing task, so
+        it is cached for ``USERS_RESOURCES_INDEX_EXISTS_CACHE_TTL`` seconds.
+        The cache entry is dropped when indexing fails.
+        """
+        ttl = current_app.config["USERS_RESOURCES_INDEX_EXISTS_CACHE_TTL"]
+        name = self._index_name(index)
+        if not ttl or kwargs:
+            return super().exists(index=name, **kwargs)
+
+        # only existing indices are cached, as tasks skipped while an index
+        # is being created would not be retried
+        if _index_exists.get(name, 0) > monotonic():
+            return True
+        exists = self.client.indices.exists(index=name)
+        if exists:
+            _index_exists[name] = monotonic() + ttl
+        return exists
+
+    def forget_exists(self, index=None):
+        """Drop the cached existence of an index."""
+        _index_exists.pop(self._index_name(index), None)
+
+    def bulk_index_records(self, records, index=None, search_bulk_kwargs=None):
+        """Index already fetched records in bulk.
+
+        Unlike ``bulk_index()``, the records are not queued for indexing but
+        dumped (within a ``CalculationContext``) and sent to the search engine
+        right away, which avoids fetching them a second time.
+
+        :param records: The records to index.
+        :param index: Physical index to write to, instead of the write alias.
+        :param dict search_bulk_kwargs: Passed to `search.helpers.bulk`.
+        :returns: A tuple with the number of indexed records and the (string)
+            IDs of the records which could not be indexed. Version conflicts,
+            i.e. records of which a newer version was indexed already, are
+            not considered as failed.
+        """
+        records = [record for record in records if record is not None]
+        if not records:
+            return 0, []
+
+        with CalculationContext(records):
+            actions = [self._record_action(record, index=index) for record in records]
+
+        ok, errors = search.helpers.bulk(
+            self.client,
+            actions,
+            stats_only=False,
+            raise_on_error=False,
+            request_timeout=current_app.config["INDEXER_BULK_REQUEST_TIMEOUT"],
+            expand_action_callback=search.helpers.expand_action,
+            **(search_bulk_kwargs or {}),
+        )
+        failed = [
+            str(item["_id"])
+            for error in errors
+            for item in error.values()
+            if item.get("status") != 409
+        ]
+        if failed:
+            # e.g. the index was deleted since its existence was cached
+            self.forget_exists()
+        elif index is None:
+            self._set_indexed_versions(records)
+        return ok, failed
+
+    def _indexed_version_key(self, id_):
+        """Cache key for the last indexed version of a record."""
+        return f"users-resources:indexed:{self.record_cls.index._name}:{id_}"
+
+    def _set_indexed_versions(self, records):
+        """Remember the versions of the records that were indexed."""
+        versions = {
+            self._indexed_version_key(record.id): record.model.version_id
+            for record in records
+            if record.model.version_id is not None
+        }
+        timeout = current_app.config["USERS_RESOURCES_INDEXED_VERSIONS_CACHE_TIMEOUT"]
+        try:
+            current_cache.set_many(versions, timeout=timeout)
+        except Exception:
+            current_app.logger.warning(
+                "Could not cache the indexed versions.", exc_info=True
+            )
+
+    def filter_indexed(self, ids, versions):
+        """Drop the IDs whose committed version was already indexed.
+
+        The versions are the ones committed by the change which triggered the
+        reindexing. Once a version (or a later one) has been indexed, the
+        document already reflects that change. IDs without a version are
+        always kept, as e.g. a change of their relations doesn't change their
+        version.
+
+        :param ids: The IDs to reindex.
+        :param versions: Mapping of (string) IDs to their committed version.
+        """
+        ids = list(ids)
+        gated = [id_ for id_ in ids if versions.get(str(id_)) is not None]
+        if not gated:
+            return ids
+
+        try:
+            indexed = current_cache.get_many(
+                *[self._indexed_version_key(id_) for id_ in gated]
+            )
+        except Exception:
+            current_app.logger.warning(
+                "Could not look up the indexed versions.", exc_info=True
+            )
+            return ids
+
+        skip = {
+            str(id_)
+            for id_, version in zip(gated, indexed)
+            if version is not None and version >= versions[str(id_)]
+        }
+        return [id_ for id_ in ids if str(id_) not in skip]
+
+    def _actionsiter(self, message_iterator):
+        """Iterate bulk actions, batch by batch."""
+        for messages in chunked(message_iterator, self.batch_size):
+            yield from self._batch_actionsiter(messages)
+
+    def _batch_actionsiter(self, messages):
+        """Iterate the bulk actions for a batch of messages."""
+        payloads = [message.decode() for message in messages]
+        ids = [payload["id"] for payload in payloads if payload["op"] != "delete"]
+        try:
+            records = dict(zip(ids, self.record_cls.get_records(ids)))
+        except Exception:
+            for message in messages:
+                message.reject()
+            current_app.logger.error(
+                "Failed to fetch records {0}".format(ids), exc_info=True
+            )
+            return
+
+        # Build the actions eagerly, so that the whole batch is dumped within
+        # the context before handing the actions over to the bulk helper.
+        actions = []
+        with CalculationContext(records.values()):
+            for message, payload in zip(messages, payloads):
+                try:
+                    if payload["op"] == "delete":
+                        action = self._delete_action(payload)
+                    else:
+                        record = records[payload["id"]]
+                        if record is None:
+                            raise NoResultFound()
+                        action = self._record_action(record)
+                except NoResultFound:
+                    message.reject()
+                    continue
+                except Exception:
+                    message.reject()
+                    current_app.logger.error(
+                        "Failed to index record {0}".format(payload.get("id")),
+                        exc_info=True,
+                    )
+                    continue
+                actions.append((message, action))
+
+        for message, action in actions:
+            yield action
+            message.ack()
+
+    def _record_action(self, record, index=None):
+        """Bulk index action for an already fetched record."""
+        record_index = self.record_to_index(record)
+
+        arguments = {}
+        body = self._prepare_record(record, record_index, arguments)
+        index = index or self._prepare_index(record_index)
+
+        action = {
+            "_op_type": "index",
+            "_index": index,
+            "_id": str(record.id),
+            "_version": record.revision_id,
+            "_version_type": self._version_type,
+            "_source": body,
+        }
+        action.update(arguments)
+
+        return action
@@ -0,0 +1,125 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Transactional outbox for the reindexing of users, groups and domains."""
+
+from celery import shared_task
+from flask import current_app
+from invenio_db import db
+from sqlalchemy import delete, func, insert, select
+
+from ..records.models import ReindexOutboxModel
+from .domains.tasks import delete_domains, reindex_domains
+from .groups.tasks import reindex_groups, unindex_groups
+from .users.tasks import reindex_group_members, reindex_users, unindex_users
+
+outbox_tasks = {
+    ("users", "index"): [reindex_users],
+    ("users", "delete"): [unindex_users],
+    ("groups", "index"): [reindex_groups, reindex_group_members],
+    ("groups", "delete"): [unindex_groups],
+    ("domains", "index"): [reindex_domains],
+    ("domains", "delete"): [delete_domains],
+}
+"""Tasks applying the operations of the outbox, per record type and operation."""
+
+
+def write_outbox(session, changes):
+    """Write the changes collected for a session to the outbox.
+
+    :param session: The session whose transaction the rows are written in.
+    :param changes: The sets of updated and deleted entities of the session,
+        as collected in ``current_db_change_history``.
+    """
+    rows = [
+        {"record_type": record_type, "record_id": str(id_), "op": op}
+        for record_type, op, ids in (
+            ("users", "index", changes.updated_users),
+            ("groups", "index", changes.updated_roles),
+            ("domains", "index", changes.updated_domains),
+            ("users", "delete", changes.deleted_users),
+            ("groups", "delete", changes.deleted_roles),
+            ("domains", "delete", changes.deleted_domains),
+        )
+        for id_ in ids
+    ]
+    if rows:
+        session.execute(insert(ReindexOutboxModel), rows)
+
+
+@shared_task(ignore_result=True)
+def process_reindex_outbox(batch_size=None, max_batches=None):
+    """Apply the pending operations of the outbox in batches.
+
+    The rows of a batch are locked (skipping the ones locked by concurrent
+    consumers), applied with the (un)indexing tasks and only removed once
+    they succeeded. Changes of the same entity within a batch are coalesced
+    into the latest one. The operations which the tasks report as failed
+    are requeued at the end of the outbox, to be retried by the next run.
+
+    :param batch_size: Number of rows per batch, defaults to
+        ``USERS_RESOURCES_REINDEX_CHUNK_SIZE``.
+    :param max_batches: Maximum number of batches per run, defaults to
+        ``USERS_RESOURCES_REINDEX_OUTBOX_MAX_BATCHES``.
+    """
+    batch_size = batch_size or current_app.config["USERS_RESOURCES_REINDEX_CHUNK_SIZE"]
+    max_batches = (
+        max_batches or current_app.config["USERS_RESOURCES_REINDEX_OUTBOX_MAX_BATCHES"]
+    )
+
+    # the operations requeued by this run are left for the next one
+    last_id = db.session.execute(select(func.max(ReindexOutboxModel.id))).scalar()
+    if last_id is None:
+        return
+
+    for _ in range(max_batches):
+        query = (
+            select(ReindexOutboxModel)
+            .where(ReindexOutboxModel.id <= last_id)
+            .order_by(ReindexOutboxModel.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        rows = db.session.execute(query).scalars().all()
+        if not rows:
+            break
+
+        latest = {}
+        for row in rows:
+            latest[(row.record_type, row.record_id)] = row.op
+
+        operations = {}
+        for (record_type, record_id), op in latest.items():
+            operations.setdefault((record_type, op), []).append(record_id)
+
+        failed = set()
+        try:
+            for (record_type, op), ids in operations.items():
+                for task in outbox_tasks[(record_type, op)]:
+                    for record_id in task(ids) or []:
+                        failed.add((record_type, str(record_id), op))
+        except Exception:
+            db.session.rollback()
+            current_app.logger.warning(
+                "Could not process the reindex outbox.", exc_info=True
+            )
+            return
+
+        # requeued before the batch is removed, so they get new IDs
+        if failed:
+            current_app.logger.warning(
+                f"Could not apply {len(failed)} operations of the reindex outbox."
+            )
+            db.session.execute(
+                insert(ReindexOutboxModel),
+                [
+                    {"record_type": record_type, "record_id": record_id, "op": op}
+                    for record_type, record_id, op in sorted(failed)
+                ],
+            )
+        db.session.execute(
+            delete(ReindexOutboxModel).where(
+                ReindexOutboxModel.id.in_([row.id for row in rows])
+            )
+        )
+        db.session.commit()
@@ -6,17 +6,25 @@
 
 """Users and user groups permissions."""
 
+from functools import lru_cache
+from itertools import chain
+
+from flask import has_request_context, request
 from invenio_access import superuser_access
 from invenio_records_permissions import BasePermissionPolicy
 from invenio_records_permissions.generators import (
     AdminAction,
+    AnyUser,
     AuthenticatedUser,
+    ConditionalGenerator,
+    Disable,
     SystemProcess,
 )
 
 from invenio_users_resources.permissions import user_management_action
 
 from .generators import (
+    AdministrationAction,
     AdministrationGroupAction,
     AdministrationUserAction,
     DenyAll,
@@ -123,3 +131,110 @@ class DomainPermissionPolicy(BasePermissionPolicy):
     can_search = [UserManager, SystemProcess()]
     can_update = [UserManager, SystemProcess()]
     can_delete = [UserManager, SystemProcess()]
+
+
+RECORD_AGNOSTIC_GENERATORS = (
+    AdministrationAction,
+    AdminAction,
+    AnyUser,
+    AuthenticatedUser,
+    DenyAll,
+    Disable,
+    GroupsEnabled,
+    SystemProcess,
+)
+"""Generators whose needs and excludes do not depend on the record."""
+
+
+@lru_cache(maxsize=256)
+def is_record_agnostic(policy_cls, action):
+    """Check if the permission of a policy for an action ignores the record."""
+    generators = getattr(policy_cls, f"can_{action}", [])
+    return all(
+        isinstance(generator, RECORD_AGNOSTIC_GENERATORS) for generator in generators
+    )
+
+
+def _is_grant_only(generator):
+    """Check if a generator can only grant a permission, but never deny it."""
+    if isinstance(generator, Self):
+        return True
+    if isinstance(generator, RECORD_AGNOSTIC_GENERATORS):
+        return not generator.excludes()
+    if isinstance(generator, ConditionalGenerator):
+        return all(map(_is_grant_only, chain(generator.then_, generator.else_)))
+    return False
+
+
+@lru_cache(maxsize=256)
+def _record_agnostic_policy(policy_cls, action):
+    """Get the policy of an action with only its record-agnostic generators.
+
+    There is none if the other generators of the action could deny the
+    permission for some records.
+    """
+    generators = getattr(policy_cls, f"can_{action}", [Disable()])
+    agnostic = [g for g in generators if isinstance(g, RECORD_AGNOSTIC_GENERATORS)]
+    others = [g for g in generators if g not in agnostic]
+    if not all(map(_is_grant_only, others)):
+        return None
+    return type(policy_cls.__name__, (policy_cls,), {f"can_{action}": agnostic})
+
+
+def allows_any_record(service, identity, action):
+    """Check if a permission is granted for any record, whichever it is.
+
+    This holds if the record-agnostic generators of the action grant the
+    permission to the identity, while its other generators (e.g. ``Self``)
+    can only grant it to more identities for some records.
+    """
+    policy = _record_agnostic_policy(service.config.permission_policy_cls, action)
+    return policy is not None and policy(action, identity=identity).allows(identity)
+
+
+def check_permission(service, identity, action, record=None, **kwargs):
+    """Check a permission of a service, memoised for the current request.
+
+    The decisions are kept per needs of the identity, so that dumping many
+    users checks the permissions of record-agnostic actions only once, and
+    those of the other actions once per user (and revision). Outside of a
+    request, the permission is checked every time. The decisions are reset
+    by ``reset_permission_decisions()`` when the superadmins change.
+    """
+    if not has_request_context():
+        return service.check_permission(identity, action, record=record, **kwargs)
+
+    decisions = getattr(request, "_users_resources_permissions", None)
+    if decisions is None:
+        decisions = request._users_resources_permissions = {}
+
+    policy_cls = service.config.permission_policy_cls
+    record_key = None
+    if record is not None and not is_record_agnostic(policy_cls, action):
+        if getattr(record, "id", None) is None:
+            return service.check_permission(identity, action, record=record, **kwargs)
+        record_key = (str(record.id), getattr(record, "revision_id", None))
+
+    key = (
+        policy_cls,
+        action,
+        frozenset(identity.provides),
+        record_key,
+        tuple(sorted(kwargs.items())),
+    )
+    try:
+        allowed = decisions.get(key)
+    except TypeError:
+        # unhashable arguments
+        return service.check_permission(identity, action, record=record, **kwargs)
+
+    if allowed is None:
+        allowed = service.check_permission(identity, action, record=record, **kwargs)
+        decisions[key] = allowed
+    return allowed
+
+
+def reset_permission_decisions():
+    """Forget the permission decisions memoised for the current request."""
+    if has_request_context():
+        request._users_resources_permissions = {}
@@ -0,0 +1,162 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Coalescing queues for the reindexing of users, groups and domains."""
+
+from collections import defaultdict
+
+from celery import shared_task
+from flask import current_app
+
+from ..proxies import current_user_resources
+from ..utils import dispatch_chunked
+from .domains.tasks import reindex_domains
+from .groups.tasks import reindex_groups
+from .users.tasks import reindex_users
+
+
+class RedisQueueBackend:
+    """Queue backend storing the IDs in Redis sets.
+
+    ``redis`` is only imported when the backend is used, as it is not a
+    dependency of this module (but e.g. of ``invenio-cache[redis]``).
+    """
+
+    def __init__(self, url):
+        """Constructor."""
+        import redis
+
+        self._client = redis.from_url(url)
+
+    def add(self, key, values):
+        """Add values to the set."""
+        self._client.sadd(key, *values)
+
+    def pop(self, key, count):
+        """Remove and return up to ``count`` values from the set."""
+        return [value.decode("utf-8") for value in self._client.spop(key, count)]
+
+    def size(self, key):
+        """Get the number of values in the set."""
+        return self._client.scard(key)
+
+
+class MemoryQueueBackend:
+    """Process-local queue backend, e.g. for tests."""
+
+    def __init__(self):
+        """Constructor."""
+        self._sets = defaultdict(set)
+
+    def add(self, key, values):
+        """Add values to the set."""
+        self._sets[key].update(values)
+
+    def pop(self, key, count):
+        """Remove and return up to ``count`` values from the set."""
+        values = self._sets[key]
+        return [values.pop() for _ in range(min(count, len(values)))]
+
+    def size(self, key):
+        """Get the number of values in the set."""
+        return len(self._sets[key])
+
+
+def queue_backend_from_url(url):
+    """Create a queue backend, in memory for ``memory://`` URLs."""
+    if url.startswith("memory://"):
+        return MemoryQueueBackend()
+    return RedisQueueBackend(url)
+
+
+class ReindexQueue:
+    """Coalescing queue of the IDs of records to reindex.
+
+    The IDs are kept in a set, so that an ID that is added several times
+    before the queue is drained is only reindexed once.
+    """
+
+    prefix = "invenio-users-resources:reindex:"
+
+    def __init__(self, name, backend):
+        """Constructor."""
+        self.name = name
+        self._backend = backend
+
+    @property
+    def key(self):
+        """Key of the set holding the IDs."""
+        return f"{self.prefix}{self.name}"
+
+    def add(self, ids):
+        """Add IDs to the queue."""
+        ids = [str(id_) for id_ in ids]
+        if ids:
+            self._backend.add(self.key, ids)
+
+    def pop(self, count):
+        """Remove and return up to ``count`` IDs from the queue."""
+        return self._backend.pop(self.key, count)
+
+    def __len__(self):
+        """Get the number of IDs in the queue."""
+        return self._backend.size(self.key)
+
+
+reindex_tasks = {
+    "users": reindex_users,
+    "groups": reindex_groups,
+    "domains": reindex_domains,
+}
+"""Reindexing tasks per queue."""
+
+
+def dispatch_reindex(name, ids, versions=None):
+    """Reindex the given IDs, via the reindex queue if enabled.
+
+    If the queue can't be reached, the reindexing is dispatched right away.
+    The committed ``versions`` of the IDs are only passed on in the latter
+    case, as the queue coalesces the IDs of several commits.
+    """
+    queue = current_user_resources.reindex_queues.get(name)
+    if queue is not None:
+        try:
+            queue.add(ids)
+            return
+        except Exception:
+            current_app.logger.warning(
+                f"Could not queue {name} for reindexing.", exc_info=True
+            )
+    dispatch_chunked(reindex_tasks[name], ids, versions=versions)
+
+
+@shared_task(ignore_result=True)
+def drain_reindex_queues(max_batches=None):
+    """Dispatch the reindexing of the IDs in the reindex queues.
+
+    At most ``max_batches`` batches (defaults to
+    ``USERS_RESOURCES_REINDEX_QUEUE_MAX_BATCHES``) of
+    ``USERS_RESOURCES_REINDEX_CHUNK_SIZE`` IDs are taken from each queue per
+    run, the remainder is left for the next run. The IDs of a batch whose
+    dispatch fails are put back in their queue.
+    """
+    batch_size = current_app.config["USERS_RESOURCES_REINDEX_CHUNK_SIZE"]
+    max_batches = (
+        max_batches or current_app.config["USERS_RESOURCES_REINDEX_QUEUE_MAX_BATCHES"]
+    )
+
+    for name, queue in current_user_resources.reindex_queues.items():
+        for _ in range(max_batches):
+            ids = queue.pop(batch_size)
+            if not ids:
+                break
+            try:
+                reindex_tasks[name].delay(ids)
+            except Exception:
+                queue.add(ids)
+                raise
+
+        current_app.logger.info(
+            f"Reindex queue '{name}' has {len(queue)} pending IDs.",
+            extra={"queue": name, "depth": len(queue)},
+        )
@@ -0,0 +1,65 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Tasks shared by the users, groups and domains services."""
+
+from celery import shared_task
+from flask import current_app
+from invenio_access.permissions import system_identity
+from invenio_records_resources.proxies import current_service_registry
+from invenio_search.engine import search
+
+
+@shared_task(
+    ignore_result=True,
+    autoretry_for=(search.exceptions.ConnectionError,),
+    retry_backoff=True,
+)
+def rebuild_index_partition(service_id, plan_id, index, start, end):
+    """Reindex a partition of the entities of a service."""
+    service = current_service_registry.get(service_id)
+    service.reindex_partition(start, end)
+    service.mark_partition_done(plan_id, index)
+
+
+@shared_task(
+    ignore_result=True,
+    autoretry_for=(search.exceptions.ConnectionError,),
+    retry_backoff=True,
+)
+def reindex_updated(service_id):
+    """Reindex the entities of a service updated since the last run."""
+    service = current_service_registry.get(service_id)
+    indexed, failed = service.reindex_updated(system_identity)
+    if failed:
+        current_app.logger.warning(
+            "Failed to reindex %s of the updated entities of '%s'.",
+            failed,
+            service_id,
+        )
+
+
+@shared_task(
+    ignore_result=True,
+    autoretry_for=(search.exceptions.ConnectionError,),
+    retry_backoff=True,
+)
+def check_index_consistency(service_id, repair=True):
+    """Check (and repair) the index of a service against the database."""
+    service = current_service_registry.get(service_id)
+    report = service.check_index_consistency(system_identity, repair=repair)
+    if report["missing"] or report["stale"] or report["orphaned"]:
+        current_app.logger.warning(
+            "Index of '%s' is inconsistent with the database: %s.",
+            service_id,
+            report,
+        )
+
+
+@shared_task(ignore_result=True)
+def rebuild_index_with_alias_swap(service_id, delete_old_index=False):
+    """Rebuild the index of a service into a new index, and swap the aliases."""
+    service = current_service_registry.get(service_id)
+    service.rebuild_index_with_alias_swap(
+        system_identity, delete_old_index=delete_old_index
+    )
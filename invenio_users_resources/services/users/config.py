@@ -36,8 +36,9 @@ from luqum.tree import Word
 from ...proxies import current_users_service
 from ...records.api import UserAggregate
 from ..common import EndpointLinkWithId, vars_func_set_querystring
+from ..indexer import AggregateIndexer
 from ..params import FixedPagination
-from ..permissions import UsersPermissionPolicy
+from ..permissions import UsersPermissionPolicy, check_permission
 from ..schemas import UserSchema
 from .results import UserItem, UserList
 from .search_params import ModerationFilterParam
@@ -45,7 +46,7 @@ from .search_params import ModerationFilterParam
 
 def can_manage(obj, ctx):
     """Check if user can manage."""
-    return current_users_service.check_permission(ctx["identity"], "manage")
+    return check_permission(current_users_service, ctx["identity"], "manage")
 
 
 def can_manage_groups(obj, ctx):
@@ -58,11 +59,15 @@ def can_manage_groups(obj, ctx):
 
     model = getattr(obj, "model", None)
     if getattr(model, "_model_obj", None) is not None:
-        return current_users_service.check_permission(
-            identity, "manage_groups", record=obj, actor_id=actor_id
+        return check_permission(
+            current_users_service,
+            identity,
+            "manage_groups",
+            record=obj,
+            actor_id=actor_id,
         )
 
-    return current_users_service.check_permission(identity, "manage_groups")
+    return check_permission(current_users_service, identity, "manage_groups")
 
 
 def word_domain_status(node):
@@ -257,6 +262,7 @@ class UsersServiceConfig(RecordServiceConfig, ConfiguratorMixin):
     service_id = "users"
     record_cls = UserAggregate
     schema = FromConfig("USERS_RESOURCES_SERVICE_SCHEMA", UserSchema)
+    indexer_cls = AggregateIndexer
     indexer_queue_name = "users"
     index_dumper = None
 
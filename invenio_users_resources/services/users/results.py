@@ -4,7 +4,15 @@
 
 """Results for the users service."""
 
+from uuid import uuid4
+
+from flask import current_app
 from invenio_records_resources.services.records.results import RecordItem, RecordList
+from marshmallow import missing
+from werkzeug.routing import BuildError
+
+from ..permissions import allows_any_record, check_permission
+from ..schemas import UserSchema
 
 
 def _role_names(user):
@@ -37,9 +45,16 @@ def _role_names(user):
 
 def _can_manage_groups(identity, service):
     """Return True if the identity can manage groups."""
-    policy = service.config.permission_policy_cls
-    permission = policy(action="manage_groups", identity=identity)
-    return permission.allows(identity)
+    return check_permission(service, identity, "manage_groups")
+
+
+def _field_permission_check(identity, service, user):
+    """Return the check of the field permissions for dumping a user."""
+
+    def _check(action, **kwargs):
+        return check_permission(service, identity, action, record=user, **kwargs)
+
+    return _check
 
 
 def _apply_roles(payload, roles, has_permission):
@@ -55,6 +70,94 @@ def _apply_roles(payload, roles, has_permission):
     return payload
 
 
+class _LinksPlaceholder:
+    """Stand-in for a user, to expand the links with a placeholder ID."""
+
+    def __init__(self, id_):
+        """Constructor."""
+        self.id = id_
+
+
+class UserProjection:
+    """Projection of indexed user documents into user results.
+
+    The permissions and links of the results are worked out once, so that the
+    documents can be projected without loading and dumping a ``UserAggregate``
+    for each of them. This is only possible for identities which may read all
+    the fields of the schema of any user (see ``allows_any_record()``), and
+    for links which only depend on the ID of the user. The user of the identity itself is not
+    projected, as its permissions and links may differ.
+    """
+
+    def __init__(self, identity, service, links, has_permission):
+        """Constructor."""
+        self._identity = identity
+        self._schema = service.schema.schema
+        self._links = links
+        self._has_permission = has_permission
+
+    @classmethod
+    def compile(cls, identity, service, links_tpl, has_permission):
+        """Compile the projection for an identity, if it is possible."""
+        if not current_app.config["USERS_RESOURCES_SEARCH_PROJECTION"]:
+            return None
+        schema = service.schema.schema
+        if type(schema) is not UserSchema or links_tpl is None:
+            return None
+
+        actions = set(schema.field_dump_permissions.values())
+        actions.add(schema.default_dump_action)
+        for action in filter(None, actions):
+            if not allows_any_record(service, identity, action):
+                return None
+
+        # the links are expanded with a placeholder, to be replaced by the IDs
+        placeholder = uuid4().hex
+        try:
+            links = links_tpl.expand(identity, _LinksPlaceholder(placeholder))
+        except (AttributeError, BuildError):
+            return None
+        links = {key: link.split(placeholder) for key, link in links.items()}
+        return cls(identity, service, links, has_permission)
+
+    def is_projected(self, source):
+        """Check if an indexed document can be projected."""
+        identity_id = self._identity.id
+        return identity_id is None or str(source["id"]) != str(identity_id)
+
+    def project(self, source):
+        """Project an indexed document into a user result."""
+        # emulate the loading of the document by the search dumper
+        source = dict(source)
+        if "email" not in source:
+            source["email"] = source.get("email_hidden")
+        version_id = source.get("version_id")
+        source["revision_id"] = version_id - 1 if version_id is not None else None
+
+        user_id = str(source["id"])
+        projection = {}
+        for name, field in self._schema.dump_fields.items():
+            key = field.data_key or name
+            if name == "links":
+                projection[key] = {
+                    link: user_id.join(parts) for link, parts in self._links.items()
+                }
+            elif name == "is_current_user":
+                projection[key] = False
+            else:
+                value = field.serialize(name, source)
+                if value is not missing:
+                    projection[key] = value
+
+        # as for loaded users, the role names are only taken from the profile
+        roles = (source.get("profile") or {}).get("roles")
+        if isinstance(roles, list):
+            roles = [role for role in roles if isinstance(role, str)]
+        else:
+            roles = []
+        return _apply_roles(projection, roles, self._has_permission)
+
+
 class UserItem(RecordItem):
     """Single user result."""
 
@@ -107,6 +210,9 @@ class UserItem(RecordItem):
             context={
                 "identity": self._identity,
                 "record": self._user,
+                "field_permission_check": _field_permission_check(
+                    self._identity, self._service, self._user
+                ),
             },
         )
         roles = _role_names(self._user)
@@ -139,10 +245,18 @@ class UserList(RecordList):
         """Iterator over the hits."""
         user_cls = self._service.record_cls
         has_permission = _can_manage_groups(self._identity, self._service)
+        user_projection = UserProjection.compile(
+            self._identity, self._service, self._links_item_tpl, has_permission
+        )
 
         for hit in self._results:
+            source = hit.to_dict()
+            if user_projection is not None and user_projection.is_projected(source):
+                yield user_projection.project(source)
+                continue
+
             # load dump
-            user = user_cls.loads(hit.to_dict())
+            user = user_cls.loads(source)
             schema = self._service.schema
 
             # project the user
@@ -151,6 +265,9 @@ class UserList(RecordList):
                 context={
                     "identity": self._identity,
                     "record": user,
+                    "field_permission_check": _field_permission_check(
+                        self._identity, self._service, user
+                    ),
                 },
             )
 
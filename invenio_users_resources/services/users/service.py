@@ -33,12 +33,16 @@ from invenio_users_resources.services.users.tasks import (
 )
 
 from ...records.api import GroupAggregate, UserAggregate
+from ..common import RebuildIndexMixin
 from .lock import ModerationMutex
 
 
-class UsersService(RecordService):
+class UsersService(RebuildIndexMixin, RecordService):
     """Users service."""
 
+    id_column = User.id
+    """Model column identifying the entities."""
+
     @property
     def user_cls(self):
         """Alias for record_cls."""
@@ -159,12 +163,6 @@ class UsersService(RecordService):
         self.require_permission(identity, "read", record=user)
         return AvatarResult(user)
 
-    def rebuild_index(self, identity, uow=None):
-        """Reindex all users managed by this service."""
-        users = db.session.query(User.id).yield_per(1000)
-        self.indexer.bulk_index([u.id for u in users])
-        return True
-
     def _check_permission(self, identity, permission_type, user):
         """Checks if given identity has the specified permission type on the user."""
         self.require_permission(
@@ -9,58 +9,103 @@ from celery import shared_task
 from flask import current_app
 from flask_security.signals import reset_password_instructions_sent
 from flask_security.utils import config_value, send_mail
+from invenio_accounts.models import userrole
 from invenio_accounts.proxies import current_datastore
+from invenio_db import db
 from invenio_records_resources.services.uow import UnitOfWork
 from invenio_records_resources.tasks import send_change_notifications
 from invenio_search.engine import search
+from sqlalchemy import select
 from werkzeug.local import LocalProxy
 
 from invenio_users_resources.services.users.lock import ModerationMutex
 
 from ...proxies import current_actions_registry, current_users_service
 from ...records.api import UserAggregate
+from ...utils import chunked, dispatch_chunked
 
 renewal_timeout = LocalProxy(
     lambda: current_app.config.get("USERS_RESOURCES_MODERATION_LOCK_RENEWAL_TIMEOUT")
 )
 
 
-@shared_task(ignore_result=True)
-def reindex_users(user_ids):
-    """Reindex the given user."""
-    index = current_users_service.record_cls.index
-    if current_users_service.indexer.exists(index):
-        try:
-            user_agg = {
-                user_id: UserAggregate.get_record(user_id) for user_id in user_ids
-            }
-            current_users_service.indexer.bulk_index(user_ids)
-
-            # trigger reindexing of related records
-            send_change_notifications(
-                "users",
-                [
-                    (
-                        user_agg[user_id].id,
-                        str(user_agg[user_id].id),
-                        user_agg[user_id].revision_id,
-                    )
-                    for user_id in user_ids
-                ],
+@shared_task(
+    ignore_result=True,
+    autoretry_for=(search.exceptions.ConnectionError,),
+    retry_backoff=True,
+)
+def reindex_users(user_ids, versions=None):
+    """Reindex the given users.
+
+    The users are fetched in batches, and each batch is indexed and used to
+    notify the related records about the change.
+
+    :param versions: The versions committed for the users, whose users are
+        skipped if these versions were already indexed.
+    :returns: The IDs of the users which could not be indexed, i.e. all of
+        them if the index does not exist.
+    """
+    current_users_service.record_rebuild_changes(user_ids)
+    indexer = current_users_service.indexer
+    if versions:
+        user_ids = indexer.filter_indexed(user_ids, versions)
+    if not user_ids:
+        return []
+    if not indexer.exists(current_users_service.record_cls.index):
+        return [str(user_id) for user_id in user_ids]
+
+    failed = []
+    for ids in chunked(user_ids, indexer.batch_size):
+        users = [u for u in UserAggregate.get_records(ids) if u is not None]
+        _, failed_ids = indexer.bulk_index_records(users)
+        if failed_ids:
+            current_app.logger.warning(
+                f"Could not bulk-reindex {len(failed_ids)} out of {len(users)} users."
             )
-        except search.exceptions.ConflictError as e:
-            current_app.logger.warning(f"Could not bulk-reindex users: {e}")
+            failed.extend(failed_ids)
+
+        # trigger reindexing of related records
+        send_change_notifications(
+            "users",
+            [(user.id, str(user.id), user.revision_id) for user in users],
+        )
+    return failed
 
 
 @shared_task(ignore_result=True)
+def reindex_group_members(group_ids):
+    """Reindex the members of the given groups.
+
+    Only the IDs of the members are queried, and they are reindexed in
+    chunks by ``reindex_users``.
+    """
+    query = (
+        select(userrole.c.user_id).where(userrole.c.role_id.in_(group_ids)).distinct()
+    )
+    user_ids = db.session.execute(query).scalars().all()
+    if user_ids:
+        dispatch_chunked(reindex_users, user_ids)
+
+
+@shared_task(
+    ignore_result=True,
+    autoretry_for=(search.exceptions.ConnectionError,),
+    retry_backoff=True,
+)
 def unindex_users(user_ids):
-    """Delete the given user from the index."""
+    """Delete the given user from the index.
+
+    :returns: The IDs of the users which could not be unindexed, i.e. all of
+        them if the index does not exist.
+    """
     index = current_users_service.record_cls.index
-    if current_users_service.indexer.exists(index):
-        try:
-            current_users_service.indexer.bulk_delete(user_ids)
-        except search.exceptions.ConflictError as e:
-            current_app.logger.warning(f"Could not bulk-unindex users: {e}")
+    if not current_users_service.indexer.exists(index):
+        return [str(user_id) for user_id in user_ids]
+    try:
+        current_users_service.indexer.bulk_delete(user_ids)
+    except search.exceptions.ConflictError as e:
+        current_app.logger.warning(f"Could not bulk-unindex users: {e}")
+    return []
 
 
 @shared_task(ignore_result=True, acks_late=True, retry=True)
@@ -0,0 +1,43 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Utilities for user and group management in Invenio."""
+
+from itertools import islice
+
+from celery import group
+from flask import current_app
+
+
+def chunked(iterable, size):
+    """Split an iterable into lists of at most ``size`` items."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def dispatch_chunked(task, ids, chunk_size=None, versions=None):
+    """Dispatch a task for the given IDs, split into chunks.
+
+    Each chunk of at most ``chunk_size`` IDs (defaults to
+    ``USERS_RESOURCES_REINDEX_CHUNK_SIZE``) is sent as a separate task of a
+    Celery group, so that the chunks are processed in parallel and retried
+    independently.
+
+    :param versions: Mapping of IDs to the versions committed for them, which
+        is passed to the task (only with the versions of its chunk).
+    """
+    chunk_size = chunk_size or current_app.config["USERS_RESOURCES_REINDEX_CHUNK_SIZE"]
+
+    def _kwargs(chunk):
+        if not versions:
+            return {}
+        chunk_versions = {str(id_): versions[id_] for id_ in chunk if id_ in versions}
+        return {"versions": chunk_versions}
+
+    ids = list(ids)
+    if len(ids) <= chunk_size:
+        return task.delay(ids, **_kwargs(ids))
+    return group(
+        task.si(chunk, **_kwargs(chunk)) for chunk in chunked(ids, chunk_size)
+    ).apply_async()
@@ -63,6 +63,12 @@ def app_config(app_config):
     app_config["ACCOUNTS_USER_PREFERENCES_SCHEMA"] = UserPreferencesNotificationsSchema
 
     app_config["USERS_RESOURCES_GROUPS_ENABLED"] = True
+    # the indices are deleted and recreated between the test modules
+    app_config["USERS_RESOURCES_INDEX_EXISTS_CACHE_TTL"] = 0
+    # the database is recreated between the test modules, which bypasses the
+    # invalidation of the superadmins
+    app_config["USERS_RESOURCES_SUPERADMINS_CACHE_TIMEOUT"] = 0
+    app_config["USERS_RESOURCES_SUPERADMIN_ROLES_CACHE_TTL"] = 0
 
     app_config["THEME_FRONTPAGE"] = False
 
@@ -4,11 +4,29 @@
 
 """Permission generators tests."""
 
+from invenio_access import ActionRoles, ActionUsers, superuser_access
+from invenio_access.permissions import authenticated_user
 from invenio_access.utils import get_identity
+from invenio_accounts.proxies import current_datastore
+from invenio_cache import current_cache
 from invenio_records_permissions.generators import AuthenticatedUser
 
 from invenio_users_resources.permissions import user_management_action
-from invenio_users_resources.services.generators import IfGroupNotManaged, PreventSelf
+from invenio_users_resources.records import hooks
+from invenio_users_resources.records.api import GroupAggregate, UserAggregate
+from invenio_users_resources.records.superadmins import (
+    SUPERADMINS_CACHE_KEY,
+    invalidate_superadmin_role_ids,
+    invalidate_superadmin_user_ids,
+    is_superadmin_user,
+    superadmin_user_ids,
+)
+from invenio_users_resources.services.generators import (
+    AdministrationUserAction,
+    IfGroupNotManaged,
+    IfSuperAdmin,
+    PreventSelf,
+)
 from invenio_users_resources.services.permissions import UserManager
 
 
@@ -34,3 +52,132 @@ def test_prevent_self_compares_ids_type_insensitively(user_pub):
     permission = PreventSelf()
     excludes = permission.excludes(record=user_pub, actor_id=str(user_pub.id))
     assert len(excludes) == 1
+
+
+def test_administration_user_action_excludes_superadmins(
+    app, user_admin, user_moderator, monkeypatch
+):
+    """Superadmins are hidden from the searches of user managers."""
+    permission = AdministrationUserAction(user_management_action)
+    identity = get_identity(user_moderator.user)
+    admin_id = user_admin.user.id
+    assert admin_id in superadmin_user_ids()
+    assert UserAggregate.get_record(admin_id).dumps()["is_superadmin"] is True
+
+    query = permission.query_filter(identity=identity).to_dict()
+    assert admin_id in query["bool"]["must_not"][0]["terms"]["id"]
+
+    # with the indexed flag, a single clause excludes all the superadmins
+    monkeypatch.setitem(app.config, "USERS_RESOURCES_SEARCH_SUPERADMIN_FLAG", True)
+    query = permission.query_filter(identity=identity).to_dict()
+    assert query == {"bool": {"must_not": [{"term": {"is_superadmin": True}}]}}
+
+
+def test_superadmin_user_ids_cached(app, db, UserFixture, monkeypatch, clear_cache):
+    """The superadmins are cached until a commit changes their access."""
+    monkeypatch.setitem(app.config, "USERS_RESOURCES_SUPERADMINS_CACHE_TIMEOUT", 60)
+    invalidate_superadmin_user_ids()
+    user_fixture = UserFixture(email="cached@inveniosoftware.org", password="c")
+    user_fixture.create(app, db)
+    user = user_fixture.user
+    assert user.id not in superadmin_user_ids()
+    assert current_cache.get(SUPERADMINS_CACHE_KEY) is not None
+
+    # e.g. granted by ``invenio access allow``, bypassing the datastore
+    db.session.add(ActionUsers.allow(superuser_access, user=user))
+    db.session.commit()
+    assert user.id in superadmin_user_ids()
+
+    # e.g. removed by ``invenio access remove``, with a bulk statement
+    ActionUsers.query_by_action(superuser_access).filter_by(user_id=user.id).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+    assert user.id not in superadmin_user_ids()
+
+    # the users denied the access don't have it, even via their roles
+    role = current_datastore.create_role(id="cached-admins", name="cached-admins")
+    current_datastore.add_role_to_user(user, role)
+    db.session.add(ActionRoles.allow(superuser_access, role=role))
+    db.session.commit()
+    assert user.id in superadmin_user_ids()
+    db.session.add(ActionUsers.deny(superuser_access, user=user))
+    db.session.commit()
+    assert user.id not in superadmin_user_ids()
+    assert not is_superadmin_user(user.id)
+
+
+def test_superadmin_changes_reindex_users(app, db, UserFixture, monkeypatch):
+    """The users whose superadmin access changed are reindexed after commit."""
+    reindexed = []
+
+    def dispatch_reindex(name, ids, versions=None):
+        reindexed.append((name, ids))
+
+    monkeypatch.setattr(hooks, "dispatch_reindex", dispatch_reindex)
+    user_fixture = UserFixture(email="reindexed@inveniosoftware.org", password="r")
+    user_fixture.create(app, db)
+    user = user_fixture.user
+    member_fixture = UserFixture(email="member@inveniosoftware.org", password="m")
+    member_fixture.create(app, db)
+    member = member_fixture.user
+    role = current_datastore.create_role(id="reindexed", name="reindexed")
+    current_datastore.add_role_to_user(member, role)
+    current_datastore.commit()
+    reindexed.clear()
+
+    # e.g. granted by ``invenio access allow``, bypassing the datastore
+    db.session.add(ActionUsers.allow(superuser_access, user_id=user.id))
+    db.session.commit()
+    assert reindexed == [("users", [user.id])]
+
+    # e.g. removed by ``invenio access remove``, with a bulk statement
+    reindexed.clear()
+    ActionUsers.query_by_action(superuser_access).filter_by(user_id=user.id).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+    assert reindexed == [("users", [user.id])]
+
+    # the members of the roles granted the access
+    reindexed.clear()
+    db.session.add(ActionRoles.allow(superuser_access, role_id=role.id))
+    db.session.commit()
+    assert reindexed == [("users", [member.id])]
+
+
+def test_if_superadmin_checks_user_records(app, user_admin, user_moderator):
+    """Superadmin users are recognised without building their identities."""
+    assert is_superadmin_user(user_admin.user.id)
+    assert not is_superadmin_user(user_moderator.user.id)
+
+    permission = IfSuperAdmin(then_=[UserManager], else_=[AuthenticatedUser()])
+    admin = UserAggregate.get_record(user_admin.user.id)
+    moderator = UserAggregate.get_record(user_moderator.user.id)
+    assert permission.needs(record=admin) == {user_management_action}
+    assert permission.needs(record=moderator) == {authenticated_user}
+
+
+def test_superadmin_group_ids_cached(app, db, monkeypatch):
+    """The superadmin groups are cached until their access changes."""
+    monkeypatch.setitem(app.config, "USERS_RESOURCES_SUPERADMIN_ROLES_CACHE_TTL", 60)
+    invalidate_superadmin_role_ids()
+    role = current_datastore.create_role(id="cached-superadmins", name="cached")
+    current_datastore.commit()
+    assert role.id not in GroupAggregate.superadmin_group_ids()
+
+    # changes committed without the datastore are noticed...
+    db.session.add(ActionRoles.allow(superuser_access, role=role))
+    db.session.commit()
+    assert role.id in GroupAggregate.superadmin_group_ids()
+
+    # ...as well as bulk statements, bypassing the unit of work
+    ActionRoles.query.filter_by(role_id=role.id).delete(synchronize_session=False)
+    db.session.commit()
+    assert role.id not in GroupAggregate.superadmin_group_ids()
+
+    # ...and the ones committed through the datastore
+    other_role = current_datastore.create_role(id="other-superadmins", name="other")
+    db.session.add(ActionRoles.allow(superuser_access, role=other_role))
+    current_datastore.commit()
+    assert other_role.id in GroupAggregate.superadmin_group_ids()
@@ -0,0 +1,33 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Aggregate indexer tests."""
+
+from unittest.mock import MagicMock
+
+from invenio_users_resources.records.api import UserAggregate
+from invenio_users_resources.services.indexer import AggregateIndexer
+
+
+def test_exists_is_cached(base_app, monkeypatch):
+    """The existence of an index is only checked once within the TTL."""
+    monkeypatch.setitem(base_app.config, "USERS_RESOURCES_INDEX_EXISTS_CACHE_TTL", 60)
+    client = MagicMock()
+    indexer = AggregateIndexer(search_client=client, record_cls=UserAggregate)
+
+    with base_app.app_context():
+        indexer.forget_exists()
+
+        # indices that don't exist (yet) are checked again
+        client.indices.exists.return_value = False
+        assert not indexer.exists(UserAggregate.index)
+        client.indices.exists.return_value = True
+        assert indexer.exists(UserAggregate.index)
+        assert indexer.exists(UserAggregate.index)
+        assert indexer.exists()
+        assert client.indices.exists.call_count == 2
+
+        indexer.forget_exists()
+        assert indexer.exists()
+        assert client.indices.exists.call_count == 3
+        indexer.forget_exists()
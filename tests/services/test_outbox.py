@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Reindex outbox tests."""
+
+from invenio_accounts.proxies import current_datastore
+
+from invenio_users_resources.records import hooks
+from invenio_users_resources.records.models import ReindexOutboxModel
+from invenio_users_resources.services import outbox
+
+
+def test_reindex_outbox(app, db, UserFixture, monkeypatch):
+    """Changes are written to the outbox and applied by the consumer."""
+    applied = []
+    for key in outbox.outbox_tasks:
+        monkeypatch.setitem(
+            outbox.outbox_tasks,
+            key,
+            [lambda ids, key=key: applied.append((key, sorted(ids)))],
+        )
+    monkeypatch.setattr(hooks.process_reindex_outbox, "delay", lambda: None)
+    monkeypatch.setitem(app.config, "USERS_RESOURCES_REINDEX_OUTBOX_ENABLED", True)
+
+    user_fixture = UserFixture(email="outbox@inveniosoftware.org", password="outbox")
+    user_fixture.create(app, db)
+    user = user_fixture.user
+    user.username = "outbox"
+    current_datastore.commit()
+    role = current_datastore.create_role(id="outbox", name="outbox")
+    current_datastore.commit()
+    db.session.delete(role)
+    current_datastore.commit()
+
+    rows = db.session.query(ReindexOutboxModel).all()
+    assert ("users", str(user.id), "index") in [
+        (row.record_type, row.record_id, row.op) for row in rows
+    ]
+
+    outbox.process_reindex_outbox()
+    assert (("users", "index"), [str(user.id)]) in applied
+    # the changes of the same entity are coalesced into the latest one
+    assert (("groups", "delete"), ["outbox"]) in applied
+    assert (("groups", "index"), ["outbox"]) not in applied
+    assert db.session.query(ReindexOutboxModel).count() == 0
+
+
+def test_reindex_outbox_requeues_failures(app, db, monkeypatch):
+    """Operations which could not be applied are kept for the next run."""
+    attempts = []
+
+    def reindex_users(ids):
+        attempts.append(sorted(ids))
+        return ids[:1] if len(attempts) == 1 else []
+
+    monkeypatch.setitem(outbox.outbox_tasks, ("users", "index"), [reindex_users])
+    db.session.query(ReindexOutboxModel).delete()
+    db.session.add_all(
+        [
+            ReindexOutboxModel(record_type="users", record_id=id_, op="index")
+            for id_ in ("1", "2")
+        ]
+    )
+    db.session.commit()
+
+    # the failed operation is requeued, but not retried within the same run
+    outbox.process_reindex_outbox()
+    assert attempts == [["1", "2"]]
+    rows = db.session.query(ReindexOutboxModel).all()
+    assert [(row.record_type, row.record_id, row.op) for row in rows] == [
+        ("users", "1", "index")
+    ]
+
+    outbox.process_reindex_outbox()
+    assert attempts == [["1", "2"], ["1"]]
+    assert db.session.query(ReindexOutboxModel).count() == 0
@@ -0,0 +1,111 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Permission policies tests."""
+
+from types import SimpleNamespace
+
+from flask_principal import AnonymousIdentity
+from invenio_access import ActionUsers, superuser_access
+from invenio_access.permissions import system_identity
+from invenio_records_permissions.generators import SystemProcess
+
+from invenio_users_resources.services.generators import DenyAll, IfSuperAdmin
+from invenio_users_resources.services.permissions import (
+    UsersPermissionPolicy,
+    allows_any_record,
+    check_permission,
+    is_record_agnostic,
+)
+
+
+class CountingService:
+    """Service stand-in counting the permission checks."""
+
+    config = SimpleNamespace(permission_policy_cls=UsersPermissionPolicy)
+
+    def __init__(self):
+        """Constructor."""
+        self.checks = []
+
+    def check_permission(self, identity, action, **kwargs):
+        """Record the permission check."""
+        self.checks.append((action, kwargs.get("record")))
+        return True
+
+
+def test_record_agnostic_actions():
+    """Only the actions without record-dependent generators are agnostic."""
+    assert is_record_agnostic(UsersPermissionPolicy, "read_system_details")
+    assert is_record_agnostic(UsersPermissionPolicy, "search")
+    assert not is_record_agnostic(UsersPermissionPolicy, "read_details")
+    assert not is_record_agnostic(UsersPermissionPolicy, "manage_groups")
+
+
+class RestrictedPolicy(UsersPermissionPolicy):
+    """Policy denying the system details of the superadmins."""
+
+    can_read_system_details = [
+        SystemProcess(),
+        IfSuperAdmin(then_=[DenyAll()], else_=[]),
+    ]
+
+
+def test_allows_any_record(database):
+    """Only the permissions which no user can restrict are granted for all."""
+    service = SimpleNamespace(
+        config=SimpleNamespace(permission_policy_cls=UsersPermissionPolicy)
+    )
+    assert allows_any_record(service, system_identity, "read_system_details")
+    # the other generators (e.g. Self) can only grant it to more identities
+    assert allows_any_record(service, system_identity, "read_email")
+    assert not allows_any_record(service, AnonymousIdentity(), "read_details")
+    # e.g. PreventSelf denies it for some users
+    assert not allows_any_record(service, system_identity, "manage")
+
+    service.config.permission_policy_cls = RestrictedPolicy
+    assert not allows_any_record(service, system_identity, "read_system_details")
+    assert allows_any_record(service, system_identity, "read_details")
+
+
+def test_check_permission_memoised(base_app):
+    """The decisions are memoised per request, action and (if needed) user."""
+    service = CountingService()
+    user = SimpleNamespace(id=1, revision_id=0)
+    other_user = SimpleNamespace(id=2, revision_id=0)
+
+    with base_app.test_request_context():
+        for record in (user, other_user, user):
+            check_permission(service, system_identity, "read_system_details", record)
+            check_permission(service, system_identity, "read_details", record)
+        assert service.checks == [
+            ("read_system_details", user),
+            ("read_details", user),
+            ("read_details", other_user),
+        ]
+
+    # the decisions are not kept across requests, nor outside of them
+    with base_app.test_request_context():
+        check_permission(service, system_identity, "read_system_details", user)
+    with base_app.app_context():
+        check_permission(service, system_identity, "read_system_details", user)
+    assert len(service.checks) == 5
+
+
+def test_check_permission_reset_on_superadmin_changes(app, db, UserFixture):
+    """The memoised decisions are dropped when the superadmins change."""
+    service = CountingService()
+    user_fixture = UserFixture(email="memoised@inveniosoftware.org", password="m")
+    user_fixture.create(app, db)
+    user = user_fixture.user
+
+    with app.test_request_context():
+        check_permission(service, system_identity, "read_details", user)
+        check_permission(service, system_identity, "read_details", user)
+        assert len(service.checks) == 1
+
+        # the grant doesn't change the user's revision
+        db.session.add(ActionUsers.allow(superuser_access, user_id=user.id))
+        db.session.commit()
+        check_permission(service, system_identity, "read_details", user)
+        assert len(service.checks) == 2
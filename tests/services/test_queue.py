@@ -0,0 +1,60 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Reindex queue tests."""
+
+from types import SimpleNamespace
+
+import pytest
+
+from invenio_users_resources.proxies import current_user_resources
+from invenio_users_resources.services import queue as queue_module
+from invenio_users_resources.services.queue import (
+    MemoryQueueBackend,
+    RedisQueueBackend,
+    ReindexQueue,
+    drain_reindex_queues,
+    queue_backend_from_url,
+)
+
+
+def test_reindex_queue_coalesces_ids():
+    """IDs added several times are only queued once."""
+    queue = ReindexQueue("users", MemoryQueueBackend())
+    queue.add([1, 2])
+    queue.add([2, 3])
+    queue.add([])
+    assert len(queue) == 3
+
+    batch = queue.pop(2)
+    assert len(batch) == 2
+    assert len(queue) == 1
+    assert sorted(batch + queue.pop(2)) == ["1", "2", "3"]
+    assert queue.pop(2) == []
+
+
+def test_queue_backend_from_url():
+    """The backend is chosen based on the URL."""
+    assert isinstance(queue_backend_from_url("memory://"), MemoryQueueBackend)
+    assert isinstance(
+        queue_backend_from_url("redis://localhost:6379/0"), RedisQueueBackend
+    )
+
+
+def test_drain_reindex_queues_keeps_failed_batches(base_app, monkeypatch):
+    """The IDs whose reindexing could not be dispatched stay queued."""
+    queue = ReindexQueue("users", MemoryQueueBackend())
+    queue.add([1, 2, 3])
+
+    def delay(ids):
+        raise ConnectionError("broker unavailable")
+
+    with base_app.app_context():
+        ext = current_user_resources._get_current_object()
+        monkeypatch.setattr(ext, "reindex_queues", {"users": queue})
+        monkeypatch.setitem(
+            queue_module.reindex_tasks, "users", SimpleNamespace(delay=delay)
+        )
+        with pytest.raises(ConnectionError):
+            drain_reindex_queues()
+    assert sorted(queue.pop(3)) == ["1", "2", "3"]
@@ -415,3 +415,13 @@ def test_super_admin_loses_manage_when_superuser_removed(
         restored = ActionRoles.create(action=superuser_access, role=superadmin_group)
         database.session.add(restored)
         database.session.commit()
+
+
+def test_groups_get_records(app, groups, group_service):
+    """Groups are fetched in bulk following the order of the given IDs."""
+    records = group_service.record_cls.get_records(["hr-dep", "unknown", "it-dep"])
+    assert [r.id if r is not None else None for r in records] == [
+        "hr-dep",
+        None,
+        "it-dep",
+    ]
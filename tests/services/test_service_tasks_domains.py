@@ -4,8 +4,17 @@
 from unittest.mock import MagicMock, patch
 
 from invenio_access.permissions import system_identity
+from invenio_accounts.models import Domain
+from invenio_cache import current_cache
 
-from invenio_users_resources.services.domains.tasks import import_domain_blocklist
+from invenio_users_resources.proxies import current_user_resources
+from invenio_users_resources.services.domains import tasks
+from invenio_users_resources.services.domains.tasks import (
+    import_domain_blocklist,
+    reindex_domain_users,
+    update_domain_counters,
+)
+from invenio_users_resources.services.indexer import AggregateIndexer
 
 
 @patch("invenio_users_resources.services.domains.tasks.requests.get")
@@ -15,7 +24,8 @@ def test_import_domain_blocklist(
     # Mock the response from requests.get
     mock_resp = MagicMock()
     mock_resp.status_code = 200
-    mock_resp.content = b"spamdomain.com.\nnew.org\n"
+    mock_resp.iter_lines.return_value = [b"spamdomain.com.", b"new.org", b""]
+    mock_resp.headers = {}
     mock_get.return_value = mock_resp
 
     domain = domains_service.read(system_identity, "new.org")
@@ -24,7 +34,14 @@ def test_import_domain_blocklist(
     assert domain.data["flagged"] is False
 
     # Call the task
-    import_domain_blocklist("http://fake-url", "testsource")
+    counts = import_domain_blocklist("http://fake-url", "testsource")
+    assert counts == {
+        "created": 1,
+        "updated": 1,
+        "removed": 0,
+        "unchanged": 0,
+        "failed": 0,
+    }
 
     domain = domains_service.read(system_identity, "spamdomain.com")
     assert domain.data["domain"] == "spamdomain.com"
@@ -39,6 +56,11 @@ def test_import_domain_blocklist(
     assert domain.data["flagged"] is True
     assert domain.data["flagged_source"] == "testsource"
 
+    # importing the same list again changes nothing
+    counts = import_domain_blocklist("http://fake-url", "testsource")
+    assert counts["unchanged"] == 2
+    assert counts["created"] == counts["updated"] == counts["removed"] == 0
+
 
 @patch("invenio_users_resources.services.domains.tasks.requests.get")
 def test_import_domain_blocklist_download_error(
@@ -51,3 +73,108 @@ def test_import_domain_blocklist_download_error(
 
     # Call the task
     import_domain_blocklist("http://fake-url", "testsource")
+    mock_resp.close.assert_called_once()
+
+
+def test_import_domain_blocklist_diff(
+    app, db, domains, domains_service, clear_cache, tmp_path
+):
+    blocklist = tmp_path / "blocklist.txt"
+    blocklist.write_text("diff-a.com\ndiff-b.com\n")
+    url = blocklist.as_uri()
+
+    counts = import_domain_blocklist(url, "diffsource")
+    assert counts["created"] == 2
+
+    # the state of the import is kept in the database, not in the cache
+    current_cache.clear()
+    assert import_domain_blocklist(url, "diffsource")["unchanged"] == 2
+
+    # only the added and removed domains are processed
+    blocklist.write_text("diff-b.com\ndiff-c.com\n")
+    counts = import_domain_blocklist(url, "diffsource")
+    assert counts["created"] == 1
+    assert counts["removed"] == 1
+    assert counts["unchanged"] == 1
+
+    domain = domains_service.read(system_identity, "diff-a.com")
+    assert domain.data["flagged"] is False
+    assert domain.data["status_name"] == "blocked"
+    domain = domains_service.read(system_identity, "diff-c.com")
+    assert domain.data["flagged"] is True
+
+
+@patch("invenio_users_resources.services.domains.tasks.requests.get")
+def test_import_domain_blocklist_not_modified(
+    mock_get, app, db, domains, domains_service, clear_cache
+):
+    mock_resp = MagicMock()
+    mock_resp.status_code = 200
+    mock_resp.iter_lines.return_value = [b"etag.org"]
+    mock_resp.headers = {"ETag": '"v1"'}
+    mock_get.return_value = mock_resp
+    assert import_domain_blocklist("http://fake-url", "etagsource")["created"] == 1
+
+    # the validators of the last import are sent along
+    mock_resp.status_code = 304
+    counts = import_domain_blocklist("http://fake-url", "etagsource")
+    assert mock_get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+    assert counts["created"] == counts["unchanged"] == 0
+    assert mock_resp.close.call_count == 2
+
+
+def test_update_domain_counters(app, db, domains, UserFixture):
+    UserFixture(email="counted@new.org", password="counted").create(app, db)
+    Domain.query.filter_by(domain="new.org").one().num_users = 42
+    db.session.commit()
+
+    assert update_domain_counters() >= 1
+    domain = Domain.query.filter_by(domain="new.org").one()
+    assert domain.num_users == domain.num_active == 1
+
+    # the counters are up to date
+    assert update_domain_counters() == 0
+    assert update_domain_counters(["new.org"]) == 0
+
+
+def test_reindex_domain_users_includes_subdomains(app, db, UserFixture, monkeypatch):
+    users = {}
+    for email in ("a@parent.org", "b@mail.parent.org", "c@otherparent.org"):
+        user_fixture = UserFixture(email=email, password="domain")
+        user_fixture.create(app, db)
+        users[email] = user_fixture.user.id
+        # as created when the users confirm their email address
+        db.session.add(Domain(domain=email.split("@")[1]))
+    db.session.commit()
+
+    # the lookup of the subdomains is refreshed before they're reindexed
+    trie = current_user_resources.domain_trie
+    trie.refresh(force=True)
+    Domain.query.filter_by(domain="parent.org").update({"flagged": True})
+    db.session.commit()
+
+    reindex_users = MagicMock()
+    monkeypatch.setattr(tasks, "reindex_users", reindex_users)
+    reindex_domain_users(["parent.org"])
+    assert trie.match("mail.parent.org", include_self=False)[0] == "parent.org"
+
+    reindexed = {
+        user_id for call in reindex_users.delay.call_args_list for user_id in call[0][0]
+    }
+    assert reindexed == {users["a@parent.org"], users["b@mail.parent.org"]}
+
+
+def test_reindex_domains_retries_failures(base_app, monkeypatch):
+    """The domains that can't be reindexed are retried by the workers."""
+    exists = MagicMock(return_value=False)
+    monkeypatch.setattr(AggregateIndexer, "exists", exists)
+    with base_app.app_context():
+
+        # called directly, e.g. by the outbox, the failed IDs are returned
+        assert tasks.reindex_domains([1, 2]) == ["1", "2"]
+        assert tasks.delete_domains([3]) == ["3"]
+
+        exists.reset_mock()
+        result = tasks.reindex_domains.apply(args=[[1, 2]])
+        assert result.failed()
+        assert exists.call_count == tasks.reindex_domains.max_retries + 1
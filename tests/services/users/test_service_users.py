@@ -5,12 +5,30 @@
 
 """User service tests."""
 
+from datetime import datetime, timedelta, timezone
+
 import pytest
+from invenio_access import ActionUsers, superuser_access
 from invenio_access.permissions import system_identity
+from invenio_accounts.models import User
+from invenio_accounts.proxies import current_datastore
+from invenio_cache import current_cache
 from invenio_records_resources.services.errors import PermissionDeniedError
 from marshmallow import ValidationError
 
-from invenio_users_resources.proxies import current_actions_registry
+from invenio_users_resources.proxies import (
+    current_actions_registry,
+    current_user_resources,
+)
+from invenio_users_resources.records import hooks
+from invenio_users_resources.records.systemfields import CalculationContext
+from invenio_users_resources.services.queue import MemoryQueueBackend, ReindexQueue
+from invenio_users_resources.services.users.results import (
+    UserProjection,
+    _can_manage_groups,
+)
+from invenio_users_resources.services.users.tasks import reindex_users
+from invenio_users_resources.utils import chunked
 
 
 @pytest.fixture(scope="function", autouse=True)
@@ -243,6 +261,30 @@ def test_search_permissions(app, db, user_service, user_moderator, user_res):
     assert search.total > 0
 
 
+def test_search_projection(app, user_service, user_moderator, user_pub, monkeypatch):
+    """The projected search hits are the same as the loaded and dumped ones."""
+
+    def search(method, identity, projection, **params):
+        monkeypatch.setitem(app.config, "USERS_RESOURCES_SEARCH_PROJECTION", projection)
+        return method(identity, **params).to_dict()["hits"]["hits"]
+
+    for method, identity, params in [
+        (user_service.search_all, user_moderator.identity, {"size": 100}),
+        (user_service.search_all, system_identity, {"size": 100}),
+        (user_service.search, user_pub.identity, {}),
+    ]:
+        hits = search(method, identity, True, **params)
+        assert hits
+        assert hits == search(method, identity, False, **params)
+
+    # the projection is only compiled for identities which may read everything
+    links_tpl = user_service.links_item_tpl
+    assert UserProjection.compile(
+        user_moderator.identity, user_service, links_tpl, True
+    )
+    assert not UserProjection.compile(user_pub.identity, user_service, links_tpl, False)
+
+
 def test_create_permission_denied(
     app, db, user_service, user_moderator, user_res, clear_cache, search_clear
 ):
@@ -754,3 +796,273 @@ def test_add_protected_role_allowed_for_superadmin(
     finally:
         user_service.remove_group(system_identity, user_pub.id, "admin")
         app.config["USERS_RESOURCES_PROTECTED_GROUP_NAMES"] = previous
+
+
+def test_get_records(user_service, user_pub, user_res):
+    """Users are fetched in bulk following the order of the given IDs."""
+    user_cls = user_service.record_cls
+    records = user_cls.get_records([user_res.id, "system", 999999, str(user_pub.id)])
+    assert [r.id if r is not None else None for r in records] == [
+        user_res.id,
+        None,
+        None,
+        user_pub.id,
+    ]
+
+    # calculated fields match the ones of the single record fetching
+    for record in (records[0], records[3]):
+        expected = user_cls.get_record(record.id)
+        assert record.domaininfo == expected.domaininfo
+        assert record.identities == expected.identities
+        assert record.roles == expected.roles
+        assert record.revision_id == expected.revision_id
+
+
+def test_calculation_context(user_service, user_pub, user_res):
+    """Calculated fields resolved for a batch match the per record ones."""
+    user_cls = user_service.record_cls
+    expected = [user_cls.get_record(u.id).dumps() for u in (user_pub, user_res)]
+
+    # records loaded from the index are not backed by a model object
+    records = [user_cls.loads(dump) for dump in expected]
+    with CalculationContext(records):
+        dumps = [record.dumps() for record in records]
+
+    for dump, expected_dump in zip(dumps, expected):
+        dump.pop("indexed_at")
+        expected_dump.pop("indexed_at")
+        assert dump == expected_dump
+
+
+def test_login_bookkeeping_skips_reindex(app, db, UserFixture, monkeypatch):
+    """Changes to the login bookkeeping alone don't reindex the user."""
+    user_fixture = UserFixture(email="login@inveniosoftware.org", password="login")
+    user_fixture.create(app, db)
+    user = user_fixture.user
+
+    dispatched = []
+    monkeypatch.setattr(
+        hooks,
+        "dispatch_reindex",
+        lambda name, ids, versions=None: dispatched.append((name, ids)),
+    )
+    user.last_login_at = datetime.now(timezone.utc)
+    user.login_count = (user.login_count or 0) + 1
+    current_datastore.commit()
+    assert ("users", [user.id]) not in dispatched
+
+    user.login_count += 1
+    user.username = "loginchanged"
+    current_datastore.commit()
+    assert ("users", [user.id]) in dispatched
+
+
+def test_reindex_users_skips_indexed_versions(
+    app, db, user_service, UserFixture, monkeypatch, clear_cache
+):
+    """Users whose committed version was already indexed are skipped."""
+    user_fixture = UserFixture(email="versions@inveniosoftware.org", password="v")
+    user_fixture.create(app, db)
+    user = user_fixture.user
+
+    indexed = []
+
+    def bulk_index_records(self, records, index=None):
+        records = [r for r in records if r is not None]
+        indexed.extend(r.id for r in records)
+        self._set_indexed_versions(records)
+        return len(records), []
+
+    monkeypatch.setattr(
+        user_service.indexer.__class__, "bulk_index_records", bulk_index_records
+    )
+
+    versions = {str(user.id): user.version_id}
+    reindex_users([user.id], versions=versions)
+    assert indexed == [user.id]
+
+    # the same version again, e.g. from a retried task
+    reindex_users([user.id], versions=versions)
+    assert indexed == [user.id]
+
+    # without a version (e.g. a change of the memberships), it is reindexed
+    reindex_users([user.id])
+    assert indexed == [user.id, user.id]
+
+
+def test_rebuild_index_partitioned(
+    app, db, user_service, users, monkeypatch, clear_cache
+):
+    """The rebuild is split into ranges, which are skipped once completed."""
+    indexed = []
+    monkeypatch.setattr(
+        user_service.indexer.__class__,
+        "bulk_index_records",
+        lambda self, records: indexed.extend(r.id for r in records if r is not None),
+    )
+    monkeypatch.setitem(app.config, "USERS_RESOURCES_REBUILD_INDEX_PARTITION_SIZE", 2)
+
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+    user_service.rebuild_index(system_identity, partitioned=True)
+    assert sorted(indexed) == sorted(user_ids)
+    progress = user_service.rebuild_index_progress()
+    assert progress["done"] == progress["total"] == (len(user_ids) + 1) // 2
+
+    # only the boundaries of the ranges are kept in the plan
+    plan = current_cache.get(user_service._rebuild_cache_key())
+    assert plan["ranges"] == [(ids[0], ids[-1]) for ids in chunked(sorted(user_ids), 2)]
+
+    # all the ranges were completed, so there is nothing left to resume
+    indexed.clear()
+    user_service.rebuild_index(system_identity, resume=True)
+    assert indexed == []
+
+
+def test_reindex_updated(app, db, user_service, UserFixture, monkeypatch, clear_cache):
+    """Only the users updated since the last run are reindexed."""
+    user_fixture = UserFixture(email="watermark@inveniosoftware.org", password="w")
+    user_fixture.create(app, db)
+    user = user_fixture.user
+
+    indexed = []
+
+    def bulk_index_records(self, records, index=None):
+        records = [r for r in records if r is not None]
+        indexed.extend(r.id for r in records)
+        return len(records), []
+
+    monkeypatch.setattr(
+        user_service.indexer.__class__, "bulk_index_records", bulk_index_records
+    )
+    monkeypatch.setattr(
+        hooks, "dispatch_reindex", lambda name, ids, versions=None: None
+    )
+    monkeypatch.setitem(
+        app.config, "USERS_RESOURCES_REINDEX_WATERMARK_OVERLAP", timedelta(0)
+    )
+
+    # without a watermark, all the users are reindexed
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+    assert user_service.reindex_updated(system_identity) == (len(user_ids), 0)
+    assert sorted(indexed) == sorted(user_ids)
+
+    indexed.clear()
+    user.username = "watermarked"
+    current_datastore.commit()
+    assert user_service.reindex_updated(system_identity) == (1, 0)
+    assert indexed == [user.id]
+
+
+def test_rebuild_replays_reindexed_users(
+    app, db, user_service, UserFixture, monkeypatch, clear_cache
+):
+    """The users reindexed during a rebuild are replayed into the new index."""
+    user_fixture = UserFixture(email="replayed@inveniosoftware.org", password="r")
+    user_fixture.create(app, db)
+    user = user_fixture.user
+
+    indexed = []
+
+    def bulk_index_records(self, records, index=None):
+        records = [r for r in records if r is not None]
+        indexed.extend((r.id, index) for r in records)
+        return len(records), []
+
+    monkeypatch.setattr(
+        user_service.indexer.__class__, "bulk_index_records", bulk_index_records
+    )
+    # the reindexed users are only recorded if enabled...
+    ext = current_user_resources._get_current_object()
+    assert ext.rebuild_queues == {}
+    queue = ReindexQueue("rebuild:users", MemoryQueueBackend())
+    monkeypatch.setattr(ext, "rebuild_queues", {"users": queue})
+
+    # ...and while a rebuild is running
+    reindex_users([user.id])
+    assert len(queue) == 0
+    running_key = user_service._rebuild_cache_key("running")
+    current_cache.set(running_key, True)
+    reindex_users([user.id])
+    current_cache.delete(running_key)
+    assert len(queue) == 1
+
+    indexed.clear()
+    user_service._replay_rebuild_changes_into("new-index")
+    assert indexed == [(user.id, "new-index")]
+    assert len(queue) == 0
+
+
+def test_rebuild_replays_access_changes(
+    app, db, user_service, UserFixture, monkeypatch, clear_cache
+):
+    """Access changes during a rebuild are replayed, without updating users."""
+    user_fixture = UserFixture(email="granted@inveniosoftware.org", password="g")
+    user_fixture.create(app, db)
+    user = user_fixture.user
+
+    indexed = []
+
+    def bulk_index_records(self, records, index=None):
+        records = [r for r in records if r is not None]
+        indexed.extend((r.id, index) for r in records)
+        return len(records), []
+
+    monkeypatch.setattr(
+        user_service.indexer.__class__, "bulk_index_records", bulk_index_records
+    )
+    queue = ReindexQueue("rebuild:users", MemoryQueueBackend())
+    ext = current_user_resources._get_current_object()
+    monkeypatch.setattr(ext, "rebuild_queues", {"users": queue})
+
+    running_key = user_service._rebuild_cache_key("running")
+    current_cache.set(running_key, True)
+    started = datetime.now(timezone.utc)
+    # without the backref of the user, which would update it
+    db.session.add(ActionUsers.allow(superuser_access, user_id=user.id))
+    current_datastore.commit()
+    current_cache.delete(running_key)
+
+    # the access isn't replayed by the updated users...
+    indexed.clear()
+    user_service._reindex_updated_into(started, "new-index")
+    assert indexed == []
+
+    # ...but by the reindexed ones
+    user_service._replay_rebuild_changes_into("new-index")
+    assert indexed == [(user.id, "new-index")]
+
+
+def test_check_index_consistency(app, user_service, users):
+    """Missing and orphaned documents are found and repaired."""
+    client = user_service.indexer.client
+    index = user_service.record_cls.index
+    user = users["pub-res"]
+    client.delete(index=index._name, id=str(user.id), refresh=True)
+    client.index(index=index._name, id="999999", body={}, refresh=True)
+
+    report = user_service.check_index_consistency(system_identity, repair=True)
+    assert report["missing"] == 1
+    assert report["stale"] == 0
+    assert report["orphaned"] == 1
+
+    user_service.indexer.process_bulk_queue()
+    index.refresh()
+    report = user_service.check_index_consistency(system_identity)
+    assert report["missing"] == report["stale"] == report["orphaned"] == 0
+
+
+def test_rebuild_index_with_alias_swap(app, user_service, users):
+    """The index is rebuilt into a new index which replaces the live one."""
+    client = user_service.indexer.client
+    index = user_service.record_cls.index
+    old_indices = set(client.indices.get_alias(name=index.search_alias))
+    total = user_service.search(system_identity).total
+
+    new_index = user_service.rebuild_index_with_alias_swap(
+        system_identity, delete_old_index=True
+    )
+
+    assert set(client.indices.get_alias(name=index.search_alias)) == {new_index}
+    assert set(client.indices.get_alias(name=index._name)) == {new_index}
+    assert not client.indices.exists(index=",".join(old_indices))
+    assert user_service.search(system_identity).total == total
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Domain lookup tests."""
+
+from invenio_accounts.models import Domain, DomainStatus
+
+from invenio_users_resources.records.domains import DomainCache, DomainTrie
+from invenio_users_resources.records.systemfields import DomainField
+
+
+def test_domain_trie(base_app, database, monkeypatch):
+    """Subdomains are matched by their closest flagged or blocked domain."""
+    monkeypatch.setitem(
+        base_app.config, "USERS_RESOURCES_DOMAINS_TRIE_REFRESH_INTERVAL", 0
+    )
+    with base_app.app_context():
+        database.session.add(Domain(domain="spam.com", status=DomainStatus.blocked))
+        database.session.add(Domain(domain="flagged.org", flagged=True))
+        database.session.add(Domain(domain="fine.org"))
+        database.session.commit()
+
+        trie = DomainTrie()
+        name, value = trie.match("mail.Spam.com")
+        assert name == "spam.com"
+        assert value["status"] == DomainStatus.blocked.value
+        assert trie.match("spam.com")[0] == "spam.com"
+        assert trie.match("spam.com", include_self=False) is None
+        assert trie.match("a.b.flagged.org")[0] == "flagged.org"
+        assert trie.match("fine.org") is None
+        assert trie.match("notspam.com") is None
+
+        # the changed domains are picked up by the next refresh
+        domain = Domain.query.filter_by(domain="spam.com").one()
+        domain.status = DomainStatus.new
+        database.session.commit()
+        assert trie.match("mail.spam.com") is None
+
+        # subdomains without a status of their own inherit it
+        info = DomainField.resolve("x.flagged.org", None)
+        assert info["flagged"] is True
+        info = DomainField.resolve(
+            "fine.org", Domain.query.filter_by(domain="fine.org").one()
+        )
+        assert info["flagged"] is False
+
+
+def test_domain_cache(base_app, monkeypatch):
+    """Domains are evicted when unused, expired or changed."""
+    monkeypatch.setitem(base_app.config, "USERS_RESOURCES_DOMAINS_CACHE_SIZE", 2)
+    with base_app.app_context():
+        cache = DomainCache()
+        cache.sync()
+        assert cache.sync() is False
+        cache.set_many({"a.org": {"flagged": False}, "b.org": {"flagged": True}})
+        assert cache.get_many(["a.org"]) == {"a.org": {"flagged": False}}
+
+        # the least recently used domain is evicted
+        cache.set_many({"c.org": {"flagged": False}})
+        assert set(cache.get_many(["a.org", "b.org", "c.org"])) == {"a.org", "c.org"}
+
+        # a change of domains in another process is picked up
+        DomainCache().invalidate()
+        cache.sync()
+        assert cache.get_many(["a.org", "c.org"]) == {}
+
+        monkeypatch.setitem(base_app.config, "USERS_RESOURCES_DOMAINS_CACHE_TTL", 0)
+        cache.set_many({"a.org": {"flagged": False}})
+        assert cache.get_many(["a.org"]) == {}
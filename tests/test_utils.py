@@ -0,0 +1,43 @@
+# SPDX-FileCopyrightText: 2026 CERN.
+# SPDX-License-Identifier: MIT
+
+"""Utilities tests."""
+
+from celery import shared_task
+
+from invenio_users_resources.utils import chunked, dispatch_chunked
+
+dispatched = []
+
+
+@shared_task
+def collect_ids(ids, versions=None):
+    """Collect the IDs received by a task."""
+    dispatched.append((ids, versions) if versions else ids)
+
+
+def test_chunked():
+    """Iterables are split into chunks of bounded size."""
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []
+
+
+def test_dispatch_chunked(base_app, monkeypatch):
+    """Large sets of IDs are dispatched as a group of bounded tasks."""
+    with base_app.app_context():
+        dispatched.clear()
+        dispatch_chunked(collect_ids, [1, 2, 3, 4, 5], chunk_size=2)
+        assert dispatched == [[1, 2], [3, 4], [5]]
+
+        dispatched.clear()
+        monkeypatch.setitem(base_app.config, "USERS_RESOURCES_REINDEX_CHUNK_SIZE", 10)
+        dispatch_chunked(collect_ids, [1, 2, 3])
+        assert dispatched == [[1, 2, 3]]
+
+
+def test_dispatch_chunked_versions(base_app):
+    """Each chunk receives the versions of its IDs."""
+    with base_app.app_context():
+        dispatched.clear()
+        dispatch_chunked(collect_ids, [1, 2, 3], chunk_size=2, versions={1: 4, 3: 2})
+        assert dispatched == [([1, 2], {"1": 4}), ([3], {"3": 2})]